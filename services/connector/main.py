@@ -1,16 +1,30 @@
 import asyncio
 import logging
+from typing import Any
 
+from connector.audio import AudioFrame, FrameDecoder
 from connector.config import settings
-from connector.nodes.base import FnNode, Node
+from connector.dsp import AGC, GainStage, HighPass, NoiseGate
+from connector.nodes.base import FnNode, Node, OverflowPolicy, log_edge_stats
 from connector.nodes.controlnode import (
     ESPControlCallbackArgs,
     ESPControlNode,
     WeightWatcher,
 )
+from connector.nodes.dspnode import DSPNode
+from connector.nodes.echonode import EchoCanceller
 from connector.nodes.gainnode import Gain
 from connector.nodes.llmnode import LLMNode
-from connector.nodes.streamnode import BroadcastStream, SDStreamNode, TTSStream
+from connector.nodes.pacernode import Pacer
+from connector.nodes.resamplernode import Resampler
+from connector.nodes.streamnode import (
+    BroadcastStream,
+    SDStreamNode,
+    STTStream,
+    TTSStream,
+)
+from connector.nodes.vadnode import VoiceActivityGate
+from connector.phrasecache import PhraseCache
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(
@@ -18,6 +32,25 @@ logging.basicConfig(
 )
 
 
+def connect_resampled(
+    sender: Node[Any, AudioFrame],
+    receiver: Node[AudioFrame, Any],
+    sender_rate: int,
+    receiver_rate: int,
+) -> None:
+    """Connect two audio nodes, inserting a resampler if their sample rates differ."""
+    if sender_rate == receiver_rate:
+        sender.add_outgoing_node(receiver)
+        return
+
+    logger.info(
+        f"Resampling {sender} -> {receiver} ({sender_rate} -> {receiver_rate} Hz)"
+    )
+    resampler = Resampler(f"{sender} Resampler", receiver_rate)
+    sender.add_outgoing_node(resampler)
+    resampler.add_outgoing_node(receiver)
+
+
 async def async_main():
     loop = asyncio.get_event_loop()
 
@@ -25,7 +58,11 @@ async def async_main():
     logger.info("Creating ESP connection")
     on_esp_conn_lost = loop.create_future()
     esp_audio_transport, esp_audio_stream = await loop.create_connection(
-        lambda: BroadcastStream[bytes, bytes]("ESP", on_esp_conn_lost),
+        lambda: BroadcastStream[AudioFrame, AudioFrame](
+            "ESP",
+            on_esp_conn_lost,
+            out_converter=FrameDecoder(settings.MIC_SAMPLE_RATE),
+        ),
         settings.ESP_ADDR,
         settings.ESP_AUDIO_PORT,
     )
@@ -42,17 +79,20 @@ async def async_main():
     logger.info("Creating RealtimeSTT connection")
     on_stt_conn_lost = loop.create_future()
     stt_transport, stt_stream = await loop.create_connection(
-        lambda: BroadcastStream[bytes, str](
-            "STT", on_stt_conn_lost, out_converter=bytes.decode
-        ),
+        lambda: STTStream("STT", on_stt_conn_lost),
         settings.STT_ADDR,
         settings.STT_PORT,
     )
 
     logger.info("Creating RealtimeTTS connection")
+    phrase_cache = None
+    if settings.PHRASE_CACHE:
+        phrase_cache = PhraseCache(
+            settings.PHRASE_CACHE_DIR, settings.PHRASE_CACHE_MAX_BYTES
+        )
     on_tts_conn_lost = loop.create_future()
     tts_transport, tts_stream = await loop.create_connection(
-        lambda: TTSStream("TTS", on_tts_conn_lost, in_converter=str.encode),
+        lambda: TTSStream("TTS", on_tts_conn_lost, phrase_cache),
         settings.TTS_ADDR,
         settings.TTS_PORT,
     )
@@ -60,43 +100,110 @@ async def async_main():
     llm_node = LLMNode("LLM", tts_stream, esp_ctrl_stream)
 
     # Setup pipeline
-    mic_gain = Gain(15.0, "Mic Gain")
-    esp_audio_stream.add_outgoing_node(mic_gain)
-    mic_gain.add_outgoing_node(stt_stream)
+    mic_dsp = DSPNode(
+        "Mic DSP",
+        [
+            HighPass(settings.MIC_HIGHPASS_CUTOFF),
+            NoiseGate(settings.MIC_GATE_THRESHOLD_DB),
+            AGC(settings.MIC_AGC_TARGET_DB, settings.MIC_AGC_MAX_GAIN_DB)
+            if settings.MIC_AGC
+            else GainStage(settings.MIC_GAIN),
+        ],
+    )
+
+    echo_canceller = None
+    if settings.AEC:
+        echo_canceller = EchoCanceller(
+            "Mic AEC",
+            settings.MIC_SAMPLE_RATE,
+            block_size=settings.AEC_BLOCK_SIZE,
+            partitions=settings.AEC_PARTITIONS,
+            max_delay=settings.AEC_MAX_DELAY,
+        )
+        esp_audio_stream.add_outgoing_node(echo_canceller)
+        echo_canceller.add_outgoing_node(mic_dsp)
+    else:
+        esp_audio_stream.add_outgoing_node(mic_dsp)
+
+    stt_input: Node[Any, AudioFrame] = mic_dsp
+    if settings.STT_VAD:
+        stt_input = VoiceActivityGate(
+            "STT VAD",
+            margin_db=settings.STT_VAD_MARGIN_DB,
+            hangover=settings.STT_VAD_HANGOVER,
+            pre_roll=settings.STT_VAD_PRE_ROLL,
+        )
+        mic_dsp.add_outgoing_node(stt_input)
+    connect_resampled(
+        stt_input, stt_stream, settings.MIC_SAMPLE_RATE, settings.STT_SPRT
+    )
 
     stt_stream.add_outgoing_node(llm_node)
 
     llm_node.add_outgoing_node(tts_stream)
 
-    tts_gain = Gain(0.5, "TTS Gain")
-    tts_stream.add_outgoing_node(tts_gain)
-    tts_gain.add_outgoing_node(esp_audio_stream)
+    tts_gain = Gain(settings.TTS_GAIN, "TTS Gain")
+    connect_resampled(
+        tts_stream, tts_gain, settings.TTS_SPRT, settings.SPEAKER_SAMPLE_RATE
+    )
+
+    # Release TTS audio in real time, so stopping doesn't have to wait for
+    # everything that was already sent to the ESP
+    tts_pacer = Pacer(
+        "TTS Pacer",
+        settings.SPEAKER_SAMPLE_RATE,
+        lead=settings.SPEAKER_LEAD,
+        chunk=settings.SPEAKER_CHUNK,
+        on_high_water=tts_transport.pause_reading,
+        on_low_water=tts_transport.resume_reading,
+        timeline=tts_stream.timeline,
+    )
+    tts_gain.add_outgoing_node(tts_pacer)
+    tts_stream.stop_callbacks.append(tts_pacer.flush)
+
+    tts_pacer.add_outgoing_node(esp_audio_stream)
+    if echo_canceller is not None:
+        tts_pacer.add_outgoing_node(echo_canceller.reference)
 
     ### DEBUG ###
-    mic_gain.add_outgoing_node(
-        SDStreamNode(samplerate=settings.MIC_SAMPLE_RATE, name="Mic Playback")
+    # Debug nodes are scheduled, so they can't add latency to the audio path
+    mic_dsp.add_outgoing_node(
+        SDStreamNode(samplerate=settings.MIC_SAMPLE_RATE, name="Mic Playback"),
+        queue_size=settings.DEBUG_EDGE_QUEUE_SIZE,
+        overflow=OverflowPolicy.DROP_OLDEST,
     )
 
     esp_ctrl_stream.add_outgoing_node(
         FnNode[ESPControlCallbackArgs, None](
             fn=lambda x: print(*x),
             name="Print",
-        )
+        ),
+        queue_size=settings.DEBUG_EDGE_QUEUE_SIZE,
+        overflow=OverflowPolicy.DROP_NEWEST,
     )
 
     stt_stream.add_outgoing_node(
         FnNode(
             lambda data: logger.info(f"Received STT Result: {data}"),
             name="Debug FN",
-        )
+        ),
+        queue_size=settings.DEBUG_EDGE_QUEUE_SIZE,
+        overflow=OverflowPolicy.DROP_NEWEST,
     )
 
+    # Nodes with scheduled outgoing connections
+    scheduling_nodes = [esp_audio_stream, esp_ctrl_stream, stt_stream, mic_dsp]
+
     pending = [
         on_esp_conn_lost,
         on_esp_ctrl_lost,
         on_stt_conn_lost,
         on_tts_conn_lost,
         asyncio.create_task(llm_node.loop()),
+        asyncio.create_task(tts_pacer.loop()),
+        asyncio.create_task(
+            log_edge_stats(scheduling_nodes, settings.EDGE_STATS_INTERVAL)
+        ),
         asyncio.ensure_future(asyncio.to_thread(input, "Press ENTER to exit\n")),
     ]
 
@@ -108,6 +215,8 @@ async def async_main():
         esp_ctrl_transport.close()
         stt_transport.close()
         tts_transport.close()
+        for node in scheduling_nodes:
+            node.close_edges()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,185 @@
+"""
+Acoustic echo cancellation building blocks for `EchoCanceller`.
+
+Both classes work on float32 sample blocks of the microphone's sample rate.
+"""
+
+import numpy as np
+
+
+class DelayEstimator:
+    """
+    Estimates by how many samples the echo in the microphone signal lags the reference.
+
+    Uses the peak of the PHAT-weighted cross correlation between the last **window**
+    microphone samples and the reference. An estimate is only accepted if the peak
+    stands out (**min_confidence** times the mean correlation) and the same delay
+    (± **tolerance** samples) was measured twice in a row.
+    """
+
+    max_delay: int
+    window: int
+    min_confidence: float
+    tolerance: int
+    fft_size: int
+
+    delay: int | None = None
+    candidate: int | None = None
+
+    def __init__(
+        self,
+        max_delay: int,
+        window: int,
+        min_confidence: float = 8.0,
+        tolerance: int = 4,
+    ) -> None:
+        self.max_delay = max_delay
+        self.window = window
+        self.min_confidence = min_confidence
+        self.tolerance = tolerance
+        self.fft_size = 1 << (2 * window + max_delay - 1).bit_length()
+
+    def update(self, mic: np.ndarray, reference: np.ndarray) -> int | None:
+        """
+        **mic** holds the last `window` microphone samples, **reference** the reference
+        samples of the same period plus the `max_delay` samples before it.
+        Returns the new delay if it changed.
+        """
+        n = self.fft_size
+        cross = np.conj(np.fft.rfft(mic, n)) * np.fft.rfft(reference, n)
+        cross /= np.abs(cross) + 1e-12
+        # correlation[k] = sum_i mic[i] * reference[i + k]
+        correlation = np.abs(np.fft.irfft(cross, n)[: self.max_delay + 1])
+
+        peak = int(np.argmax(correlation))
+        if correlation[peak] < self.min_confidence * correlation.mean():
+            return None
+
+        delay = self.max_delay - peak
+        if self.candidate is None or abs(delay - self.candidate) > self.tolerance:
+            self.candidate = delay
+            return None
+
+        if self.delay is not None and abs(delay - self.delay) <= self.tolerance:
+            return None
+        self.delay = delay
+        return delay
+
+
+class PartitionedFDAF:
+    """
+    Partitioned-block frequency-domain adaptive filter (overlap-save NLMS).
+
+    Models an echo path of **partitions** * **block_size** samples. Each call to
+    `process` takes one block of reference and microphone samples and returns the
+    microphone block with the estimated echo subtracted. All partitions are filtered
+    and adapted with one vectorized FFT pass.
+
+    Adaptation pauses during double talk: once the filter has converged, a sudden
+    rise of the residual by **double_talk_ratio** over the expected level is taken as
+    near-end speech. If it lasts longer than **max_double_talk_blocks**, the echo
+    path is assumed to have changed and adaptation resumes.
+    """
+
+    block_size: int
+    partitions: int
+    step_size: float
+    smoothing: float
+    double_talk_ratio: float
+    max_double_talk_blocks: int
+
+    weights: np.ndarray  # (partitions, block_size + 1) frequency domain filter
+    spectra: np.ndarray  # reference spectra of the last `partitions` blocks
+    power: np.ndarray  # smoothed reference power per bin
+    last_reference: np.ndarray
+    padded: np.ndarray
+    active_blocks: int = 0  # blocks until the reference history is silent again
+    erle: float = 1.0  # smoothed echo return loss enhancement (linear)
+    double_talk_blocks: int = 0
+
+    def __init__(
+        self,
+        block_size: int,
+        partitions: int,
+        step_size: float = 0.5,
+        smoothing: float = 0.9,
+        double_talk_ratio: float = 8.0,
+        max_double_talk_blocks: int = 375,
+    ) -> None:
+        self.block_size = block_size
+        self.partitions = partitions
+        self.step_size = step_size
+        self.smoothing = smoothing
+        self.double_talk_ratio = double_talk_ratio
+        self.max_double_talk_blocks = max_double_talk_blocks
+
+        bins = block_size + 1
+        self.weights = np.zeros((partitions, bins), np.complex64)
+        self.spectra = np.zeros((partitions, bins), np.complex64)
+        self.power = np.zeros(bins, np.float32)
+        self.last_reference = np.zeros(block_size, np.float32)
+        self.padded = np.zeros(2 * block_size, np.float32)
+
+    def reset(self) -> None:
+        self.weights[:] = 0
+        self.spectra[:] = 0
+        self.power[:] = 0
+        self.last_reference[:] = 0
+        self.active_blocks = 0
+        self.erle = 1.0
+        self.double_talk_blocks = 0
+
+    def is_double_talk(self, mic: np.ndarray, error: np.ndarray) -> bool:
+        mic_energy = float(np.dot(mic, mic)) + 1e-3
+        error_energy = float(np.dot(error, error)) + 1e-3
+
+        if error_energy * self.erle > self.double_talk_ratio * mic_energy:
+            self.double_talk_blocks += 1
+            if self.double_talk_blocks <= self.max_double_talk_blocks:
+                return True
+        else:
+            self.double_talk_blocks = 0
+
+        self.erle = self.smoothing * self.erle + (1 - self.smoothing) * (
+            mic_energy / error_energy
+        )
+        return False
+
+    def process(self, reference: np.ndarray, mic: np.ndarray) -> np.ndarray:
+        n = self.block_size
+
+        if np.any(reference):
+            self.active_blocks = self.partitions
+        elif self.active_blocks == 0:
+            return mic  # no reference in the filter's memory: there can't be any echo
+        else:
+            self.active_blocks -= 1
+
+        self.padded[:n] = self.last_reference
+        self.padded[n:] = reference
+        self.last_reference[:] = reference
+
+        spectrum = np.fft.rfft(self.padded)
+        self.spectra[1:] = self.spectra[:-1]
+        self.spectra[0] = spectrum
+
+        echo = np.fft.irfft((self.spectra * self.weights).sum(axis=0), 2 * n)[n:]
+        error = (mic - echo).astype(np.float32)
+
+        if not self.is_double_talk(mic, error):
+            self.power *= self.smoothing
+            self.power += (1 - self.smoothing) * (spectrum.real**2 + spectrum.imag**2)
+
+            self.padded[:n] = 0
+            self.padded[n:] = error
+            error_spectrum = np.fft.rfft(self.padded)
+
+            gradient = np.conj(self.spectra) * (
+                self.step_size * error_spectrum / (self.partitions * self.power + 1e-3)
+            )
+            # Constrain to a linear (not circular) correlation per partition
+            impulse = np.fft.irfft(gradient, 2 * n, axis=1)
+            impulse[:, n:] = 0
+            self.weights += np.fft.rfft(impulse, axis=1).astype(np.complex64)
+
+        return error
@@ -0,0 +1,128 @@
+import time
+from typing import Self
+
+import numpy as np
+
+SAMPLE_DTYPE = np.int16
+SAMPLE_WIDTH = np.dtype(SAMPLE_DTYPE).itemsize
+
+
+class AudioFrame:
+    """
+    A block of interleaved 16 bit PCM audio.
+
+    `samples` is a NumPy view on the buffer the frame was created from, so passing a
+    frame along the node graph doesn't copy any audio. Nodes that modify samples call
+    `writable()` first, which only copies if the frame is shared with other nodes or
+    backed by read-only memory (e.g. `bytes` received from a socket).
+
+    A node that keeps a reference to a frame after passing it on must `share()` it.
+    """
+
+    __slots__ = ("samples", "sample_rate", "channels", "timestamp_ns", "exclusive")
+
+    samples: np.ndarray
+    sample_rate: int
+    channels: int
+    timestamp_ns: int
+    exclusive: bool
+
+    def __init__(
+        self,
+        samples: np.ndarray,
+        sample_rate: int,
+        channels: int = 1,
+        timestamp_ns: int | None = None,
+        exclusive: bool = True,
+    ) -> None:
+        self.samples = samples
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.timestamp_ns = (
+            time.monotonic_ns() if timestamp_ns is None else timestamp_ns
+        )
+        self.exclusive = exclusive
+
+    @classmethod
+    def from_bytes(
+        cls,
+        data: bytes | bytearray | memoryview,
+        sample_rate: int,
+        channels: int = 1,
+        timestamp_ns: int | None = None,
+    ) -> Self:
+        """Wrap **data** without copying. Its length must be a multiple of the sample width."""
+        return cls(
+            np.frombuffer(data, SAMPLE_DTYPE), sample_rate, channels, timestamp_ns
+        )
+
+    def __len__(self) -> int:
+        """Number of samples per channel."""
+        return len(self.samples) // self.channels
+
+    def __buffer__(self, flags: int) -> memoryview:
+        return self.view
+
+    @property
+    def view(self) -> memoryview:
+        """Byte view on the samples, e.g. for writing them to a transport."""
+        return memoryview(self.samples).cast("B")
+
+    @property
+    def nbytes(self) -> int:
+        return self.samples.nbytes
+
+    @property
+    def duration(self) -> float:
+        return len(self) / self.sample_rate
+
+    def share(self) -> Self:
+        """Mark the frame as shared, so no node modifies it in place anymore."""
+        self.exclusive = False
+        return self
+
+    def writable(self) -> "AudioFrame":
+        """
+        Return a frame whose samples may be modified in place.
+
+        This is the frame itself if it is owned exclusively and writeable,
+        otherwise a copy with the same metadata.
+        """
+        if self.exclusive and self.samples.flags.writeable:
+            return self
+
+        return AudioFrame(
+            self.samples.copy(), self.sample_rate, self.channels, self.timestamp_ns
+        )
+
+
+class FrameDecoder:
+    """
+    Converts a PCM byte stream (e.g. from a socket) into `AudioFrame`s.
+
+    Stream chunks don't have to be aligned to whole samples:
+    a trailing partial sample is kept and prepended to the next chunk.
+    """
+
+    sample_rate: int
+    channels: int
+    remainder: bytes
+
+    def __init__(self, sample_rate: int, channels: int = 1) -> None:
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.remainder = b""
+
+    def __call__(self, data: bytes | memoryview) -> AudioFrame | None:
+        timestamp_ns = time.monotonic_ns()
+        if self.remainder:
+            data = self.remainder + data
+
+        aligned = len(data) - len(data) % (SAMPLE_WIDTH * self.channels)
+        self.remainder = bytes(data[aligned:])
+        if aligned == 0:
+            return None
+
+        return AudioFrame.from_bytes(
+            memoryview(data)[:aligned], self.sample_rate, self.channels, timestamp_ns
+        )
@@ -11,19 +11,80 @@ class Settings(BaseSettings):
 
     STT_ADDR: str = "localhost"
     STT_PORT: int = 9001
-    STT_SPRT: int = 16000
+    STT_SPRT: int = 16000  # sample rate the STT server expects
 
     TTS_ADDR: str = "localhost"
     TTS_PORT: int = 9002
-    TTS_SPRT: int = 22500
+    TTS_SPRT: int = 24000  # sample rate the TTS backend produces
 
     # AudioStream config
     MIC_SAMPLE_RATE: int = 16000
     SPEAKER_SAMPLE_RATE: int = 24000
 
+    # Mic processing config (levels in dBFS)
+    MIC_HIGHPASS_CUTOFF: float = 80.0
+    MIC_GATE_THRESHOLD_DB: float = -60.0
+    MIC_AGC: bool = True
+    MIC_AGC_TARGET_DB: float = -20.0
+    MIC_AGC_MAX_GAIN_DB: float = 30.0
+    MIC_GAIN: float = 15.0  # fixed gain, only used if MIC_AGC is disabled
+
+    # Echo cancellation (removes the robot's own voice from the mic signal)
+    AEC: bool = True
+    AEC_BLOCK_SIZE: int = 128
+    AEC_PARTITIONS: int = 8  # echo tail = AEC_BLOCK_SIZE * AEC_PARTITIONS samples
+    AEC_MAX_DELAY: float = 0.25
+
+    # Utterances are ignored (except for stopwords) if the robot talked while they were
+    # spoken or up to this long before, as they are likely transcriptions of the
+    # robot's own voice
+    STT_MUTE_SLACK: float = 2.0
+
+    # Only forward speech (plus context) to the STT
+    STT_VAD: bool = True
+    STT_VAD_MARGIN_DB: float = 10.0
+    STT_VAD_HANGOVER: float = 0.3
+    STT_VAD_PRE_ROLL: float = 0.3
+
+    TTS_GAIN: float = 0.5
+
+    # LLM output is sent to the TTS in clauses of at least this many characters,
+    # or whatever arrived after this many seconds without a clause boundary
+    TTS_SEGMENT_MIN_LENGTH: int = 10
+    TTS_SEGMENT_MAX_DELAY: float = 0.3
+
+    # Synthesized fixed phrases (confirmations, recipe steps, ...) are cached on disk
+    PHRASE_CACHE: bool = True
+    PHRASE_CACHE_DIR: Path = Path.home() / ".cache" / "connector" / "phrases"
+    PHRASE_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    PHRASE_PREFETCH_LOOKAHEAD: int = 2  # recipe steps synthesized ahead of time
+
+    # Speaker pacing: how far audio is sent ahead of playback (bounds stop latency)
+    SPEAKER_LEAD: float = 0.15
+    SPEAKER_CHUNK: float = 0.02
+
+    # Node graph config
+    DEBUG_EDGE_QUEUE_SIZE: int = 64
+    EDGE_STATS_INTERVAL: float = 30.0
+
+    # Start generating a response once a partial transcript has been stable this long.
+    # It's only used if the final transcript matches.
+    LLM_SPECULATION: bool = True
+    LLM_SPECULATION_WINDOW: float = 0.3
+
     # LLM config
     OPENAI_MODEL: str = "gpt-4.1-mini"
     OPENAI_API_KEY: str = "YOUR_API_KEY"
+    # Older turns are dropped once the conversation (without the system prompt) is
+    # estimated to exceed this many tokens (about 4 characters per token).
+    LLM_HISTORY_MAX_TOKENS: int = 6000
+    # Continue the previous response stored by OpenAI instead of resending the history
+    LLM_STATEFUL: bool = False
+    # Deadline for a response, including retries of failed function calls
+    LLM_TURN_TIMEOUT: float = 20.0
+    # Handle short commands in MIXING mode (e.g. "weiter", "Rezept abbrechen") without
+    # the LLM
+    LLM_LOCAL_INTENTS: bool = True
 
     # Path config
     # Assumes the project root is two levels up from this file
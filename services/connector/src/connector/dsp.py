@@ -0,0 +1,269 @@
+"""
+Vectorized audio processing stages for `DSPNode`.
+
+Stages work in place on a float32 buffer holding one frame of mono samples in int16
+scale and keep all their state between frames, so a chain of stages processes a frame
+in a single pass without allocating. Saturation to the int16 range happens once, when
+`DSPNode` writes the result back to the frame.
+"""
+
+import math
+
+import numpy as np
+
+INT16_MAX = float(np.iinfo(np.int16).max)
+INT16_MIN = float(np.iinfo(np.int16).min)
+
+
+def db_to_amplitude(db: float) -> float:
+    return 10 ** (db / 20)
+
+
+def dbfs(x: np.ndarray) -> float:
+    """RMS level of **x** in dB relative to int16 full scale."""
+    if len(x) == 0:
+        return -math.inf
+    rms = math.sqrt(float(np.dot(x, x)) / len(x))
+    return 20 * math.log10(rms / INT16_MAX) if rms > 0 else -math.inf
+
+
+def smoothing_coefficient(time_constant: float, interval: float) -> float:
+    """Per-update coefficient of a one-pole smoother updated every **interval** seconds."""
+    if time_constant <= 0:
+        return 0.0
+    return math.exp(-interval / time_constant)
+
+
+class Stage:
+    """A step of a `DSPNode` chain. Modifies the samples passed to `process` in place."""
+
+    def process(self, x: np.ndarray, sample_rate: int) -> None: ...
+
+    def reset(self) -> None:
+        """Forget all state carried over between frames."""
+
+
+class GainRamp:
+    """
+    Applies a gain that changes linearly over the frame, so gain changes between
+    frames don't produce audible steps. Ramps are cached per frame length.
+    """
+
+    ramps: dict[int, np.ndarray]
+    scratch: np.ndarray
+
+    def __init__(self) -> None:
+        self.ramps = {}
+        self.scratch = np.empty(0, np.float32)
+
+    def apply(self, x: np.ndarray, start: float, end: float) -> None:
+        n = len(x)
+        if start == end:
+            x *= start
+            return
+
+        if (ramp := self.ramps.get(n)) is None:
+            ramp = self.ramps[n] = np.arange(1, n + 1, dtype=np.float32) / n
+        if len(self.scratch) < n:
+            self.scratch = np.empty(n, np.float32)
+
+        gains = self.scratch[:n]
+        np.multiply(ramp, end - start, out=gains)
+        gains += start
+        x *= gains
+
+
+class GainStage(Stage):
+    gain: float
+
+    def __init__(self, gain: float) -> None:
+        self.gain = gain
+
+    def process(self, x: np.ndarray, sample_rate: int) -> None:
+        x *= self.gain
+
+
+class HighPass(Stage):
+    """
+    First order high-pass filter, e.g. to remove the DC offset of the microphone.
+
+    The recursion y[n] = a * (y[n-1] + x[n] - x[n-1]) is evaluated for a whole block
+    at once by multiplying the differences with a precomputed lower triangular matrix
+    of powers of a. Longer frames are processed in blocks of `block_size` samples.
+    """
+
+    cutoff: float
+    block_size: int
+
+    sample_rate: int = 0
+    coefficient: float
+    impulse_matrix: np.ndarray  # M[n, k] = a^(n - k + 1) for k <= n
+    decay: np.ndarray  # a^(n + 1)
+    diff: np.ndarray
+
+    last_x: float = 0.0
+    last_y: float = 0.0
+
+    def __init__(self, cutoff: float, block_size: int = 64) -> None:
+        self.cutoff = cutoff
+        self.block_size = block_size
+        self.diff = np.empty(block_size, np.float32)
+
+    def configure(self, sample_rate: int) -> None:
+        self.sample_rate = sample_rate
+        a = self.coefficient = math.exp(-2 * math.pi * self.cutoff / sample_rate)
+
+        n = np.arange(self.block_size)
+        exponents = n[:, None] - n[None, :] + 1
+        self.impulse_matrix = np.where(exponents > 0, a ** exponents.clip(0), 0).astype(
+            np.float32
+        )
+        self.decay = (a ** (n + 1)).astype(np.float32)
+
+    def process(self, x: np.ndarray, sample_rate: int) -> None:
+        if sample_rate != self.sample_rate:
+            self.configure(sample_rate)
+
+        for start in range(0, len(x), self.block_size):
+            block = x[start : start + self.block_size]
+            n = len(block)
+            diff = self.diff[:n]
+
+            np.subtract(block[1:], block[:-1], out=diff[1:])
+            diff[0] = block[0] - self.last_x
+            self.last_x = float(block[-1])
+
+            np.matmul(self.impulse_matrix[:n, :n], diff, out=block)
+            block += self.last_y * self.decay[:n]
+            self.last_y = float(block[-1])
+
+    def reset(self) -> None:
+        self.last_x = self.last_y = 0.0
+
+
+class NoiseGate(Stage):
+    """
+    Attenuates frames whose level stays below **threshold_db** (dBFS).
+
+    The gate opens as soon as a frame exceeds the threshold and closes once the level
+    has stayed below threshold - **hysteresis_db** for **hold** seconds.
+    Gain changes are smoothed with the **attack**/**release** time constants.
+    """
+
+    threshold_db: float
+    hysteresis_db: float
+    hold: float
+    attack: float
+    release: float
+    floor_gain: float
+
+    is_open: bool = False
+    gain: float
+    time_below: float = 0.0
+    ramp: GainRamp
+
+    def __init__(
+        self,
+        threshold_db: float,
+        hysteresis_db: float = 6.0,
+        hold: float = 0.2,
+        attack: float = 0.002,
+        release: float = 0.05,
+        attenuation_db: float = -40.0,
+    ) -> None:
+        self.threshold_db = threshold_db
+        self.hysteresis_db = hysteresis_db
+        self.hold = hold
+        self.attack = attack
+        self.release = release
+        self.floor_gain = db_to_amplitude(attenuation_db)
+        self.gain = self.floor_gain
+        self.ramp = GainRamp()
+
+    def process(self, x: np.ndarray, sample_rate: int) -> None:
+        level = dbfs(x)
+        duration = len(x) / sample_rate
+
+        if level >= self.threshold_db:
+            self.is_open = True
+            self.time_below = 0.0
+        elif level < self.threshold_db - self.hysteresis_db:
+            self.time_below += duration
+            if self.time_below >= self.hold:
+                self.is_open = False
+
+        target = 1.0 if self.is_open else self.floor_gain
+        time_constant = self.attack if target > self.gain else self.release
+        a = smoothing_coefficient(time_constant, duration)
+        gain = target + (self.gain - target) * a
+
+        self.ramp.apply(x, self.gain, gain)
+        self.gain = gain
+
+    def reset(self) -> None:
+        self.is_open = False
+        self.gain = self.floor_gain
+        self.time_below = 0.0
+
+
+class AGC(Stage):
+    """
+    Streaming automatic gain control.
+
+    Tracks the signal level with an envelope follower (fast **attack** when the level
+    rises, slow **release** when it falls) and adjusts the gain so the envelope meets
+    **target_db** (dBFS), limited to [**min_gain_db**, **max_gain_db**]. While the
+    envelope is below **noise_floor_db**, the gain is held, so silence and room noise
+    aren't amplified up to the target level.
+    """
+
+    target: float
+    min_gain: float
+    max_gain: float
+    noise_floor: float
+    attack: float
+    release: float
+
+    envelope: float = 0.0
+    gain: float
+    ramp: GainRamp
+
+    def __init__(
+        self,
+        target_db: float = -20.0,
+        max_gain_db: float = 30.0,
+        min_gain_db: float = -10.0,
+        noise_floor_db: float = -65.0,
+        attack: float = 0.01,
+        release: float = 0.5,
+        initial_gain_db: float = 0.0,
+    ) -> None:
+        self.target = db_to_amplitude(target_db) * INT16_MAX
+        self.max_gain = db_to_amplitude(max_gain_db)
+        self.min_gain = db_to_amplitude(min_gain_db)
+        self.noise_floor = db_to_amplitude(noise_floor_db) * INT16_MAX
+        self.attack = attack
+        self.release = release
+        self.gain = db_to_amplitude(initial_gain_db)
+        self.ramp = GainRamp()
+
+    def process(self, x: np.ndarray, sample_rate: int) -> None:
+        if len(x) == 0:
+            return
+
+        duration = len(x) / sample_rate
+        rms = math.sqrt(float(np.dot(x, x)) / len(x))
+
+        time_constant = self.attack if rms > self.envelope else self.release
+        a = smoothing_coefficient(time_constant, duration)
+        self.envelope = rms + (self.envelope - rms) * a
+
+        gain = self.gain
+        if self.envelope > self.noise_floor:
+            gain = min(max(self.target / self.envelope, self.min_gain), self.max_gain)
+
+        self.ramp.apply(x, self.gain, gain)
+        self.gain = gain
+
+    def reset(self) -> None:
+        self.envelope = 0.0
@@ -0,0 +1,55 @@
+"""Length-prefixed message framing shared by the TTS and STT server protocols."""
+
+import struct
+
+HEADER = struct.Struct("<BI")  # message type, payload length
+
+
+def encode_message(msg_type: int, payload: bytes) -> bytes:
+    return HEADER.pack(msg_type, len(payload)) + payload
+
+
+class MessageDecoder:
+    """
+    Splits a byte stream into (type, payload) messages.
+
+    Payloads are memoryviews into the received data, so they aren't copied unless
+    a message spans several chunks.
+    """
+
+    pending: list[bytes]
+    pending_len: int = 0
+    needed: int = HEADER.size  # bytes needed before the next message can be complete
+
+    def __init__(self) -> None:
+        self.pending = []
+
+    def feed(self, data: bytes) -> list[tuple[int, memoryview]]:
+        self.pending.append(data)
+        self.pending_len += len(data)
+        if self.pending_len < self.needed:
+            return []
+
+        buf = memoryview(
+            self.pending[0] if len(self.pending) == 1 else b"".join(self.pending)
+        )
+        messages = []
+        offset = 0
+        while True:
+            if len(buf) - offset < HEADER.size:
+                self.needed = HEADER.size
+                break
+
+            msg_type, length = HEADER.unpack_from(buf, offset)
+            end = offset + HEADER.size + length
+            if len(buf) < end:
+                self.needed = end - offset
+                break
+
+            messages.append((msg_type, buf[offset + HEADER.size : end]))
+            offset = end
+
+        rest = buf[offset:]
+        self.pending = [bytes(rest)] if rest else []
+        self.pending_len = len(rest)
+        return messages
@@ -0,0 +1,205 @@
+import logging
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable
+
+from openai.types.responses import ResponseFunctionToolCall
+
+logger = logging.getLogger(__name__)
+
+ITEM_OVERHEAD = 4  # tokens the API adds per item (role, delimiters)
+SUMMARY_MAX_CHARS = 600
+SUMMARY_MESSAGE_CHARS = 80  # per dropped user message
+
+
+def count_tokens(text: str) -> int:
+    """Estimated number of tokens of **text**, which is good enough for the budget."""
+    return (len(text) + 3) // 4
+
+
+@dataclass
+class _Item:
+    param: dict[str, Any]  # as passed to the API
+    tokens: int
+
+    @property
+    def call_id(self) -> str | None:
+        return self.param.get("call_id")
+
+    @property
+    def is_user_message(self) -> bool:
+        return self.param.get("role") == "user"
+
+
+class ConversationHistory:
+    """
+    Conversation history of an LLM, limited to **max_tokens** (without the system
+    prompt, which is always kept).
+
+    Items are stored in their compact input form instead of full response objects.
+    If the budget is exceeded, the oldest turns (a user message and everything
+    up to the next one) are dropped, together with function call outputs belonging
+    to their function calls and vice versa. Dropped user messages are kept as a short
+    summary. The latest turn is never dropped.
+    """
+
+    system_prompt: _Item
+    items: list[_Item]
+    max_tokens: int | None
+    count_tokens: Callable[[str], int]
+
+    summary: list[str]  # dropped user messages, shortened
+    summary_item: _Item | None = None
+    version: int = 0  # incremented on every change
+    rewrites: int = 0  # incremented whenever items are dropped (not just appended)
+    dropped_turns: int = 0
+
+    def __init__(
+        self,
+        system_prompt: str,
+        max_tokens: int | None = None,
+        count_tokens: Callable[[str], int] = count_tokens,
+    ) -> None:
+        self.count_tokens = count_tokens
+        self.max_tokens = max_tokens
+        self.system_prompt = self._item({"role": "system", "content": system_prompt})
+        self.items = []
+        self.summary = []
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    @property
+    def tokens(self) -> int:
+        """Estimated size of the conversation, without the system prompt."""
+        summary_tokens = self.summary_item.tokens if self.summary_item else 0
+        return summary_tokens + sum(item.tokens for item in self.items)
+
+    @property
+    def prompt_tokens(self) -> int:
+        """Estimated size of the whole input."""
+        return self.system_prompt.tokens + self.tokens
+
+    def input(
+        self, message_content: str | None = None, start: int | None = None
+    ) -> list[dict[str, Any]]:
+        """
+        The items to send, plus **message_content** as a new user message.
+
+        If **start** is passed, only items from that index on are returned (e.g. those
+        added since a previous response, which the API can continue from).
+        """
+        if start is None:
+            items = [self.system_prompt.param]
+            if self.summary_item is not None:
+                items.append(self.summary_item.param)
+            items.extend(item.param for item in self.items)
+        else:
+            items = [item.param for item in self.items[start:]]
+        if message_content:
+            items.append({"role": "user", "content": message_content})
+        return items
+
+    def add_user_message(self, content: str) -> None:
+        self._append(self._item({"role": "user", "content": content}))
+
+    def add_system_message(self, content: str) -> None:
+        self._append(self._item({"role": "system", "content": content}))
+
+    def add_output(self, output: Iterable[Any]) -> None:
+        """Appends the messages and function calls of a response's output."""
+        for item in output:
+            match item.type:
+                case "message":
+                    text = "".join(
+                        part.text for part in item.content if part.type == "output_text"
+                    )
+                    self._append(self._item({"role": "assistant", "content": text}))
+                case "function_call":
+                    self._append(self._function_call(item))
+
+    def add_function_call_output(
+        self, output: str, function_call: ResponseFunctionToolCall
+    ) -> None:
+        if not any(item.call_id == function_call.call_id for item in self.items):
+            # The call was dropped, but the API needs the call for its output
+            self.items.append(self._function_call(function_call))
+        self._append(
+            self._item(
+                {
+                    "type": "function_call_output",
+                    "call_id": function_call.call_id,
+                    "output": output,
+                }
+            )
+        )
+
+    def _function_call(self, call: ResponseFunctionToolCall) -> _Item:
+        return self._item(
+            {
+                "type": "function_call",
+                "call_id": call.call_id,
+                "name": call.name,
+                "arguments": call.arguments,
+            }
+        )
+
+    def _item(self, param: dict[str, Any]) -> _Item:
+        text = "".join(
+            str(param.get(key, ""))
+            for key in ("content", "name", "arguments", "output")
+        )
+        return _Item(param, self.count_tokens(text) + ITEM_OVERHEAD)
+
+    def _append(self, item: _Item) -> None:
+        self.items.append(item)
+        self.version += 1
+        if self.max_tokens is not None and self.tokens > self.max_tokens:
+            self._enforce_budget(self.max_tokens)
+
+    def _enforce_budget(self, max_tokens: int) -> None:
+        dropped_turns = self.dropped_turns
+        while self.tokens > max_tokens:
+            # The oldest turn ends before the next user message
+            end = next(
+                (
+                    i
+                    for i, item in enumerate(self.items)
+                    if i > 0 and item.is_user_message
+                ),
+                None,
+            )
+            if end is None:
+                break  # only the latest turn is left
+            dropped, self.items = self.items[:end], self.items[end:]
+
+            call_ids = {item.call_id for item in dropped if item.call_id}
+            self.items = [item for item in self.items if item.call_id not in call_ids]
+
+            self.summary.extend(
+                item.param["content"][:SUMMARY_MESSAGE_CHARS]
+                for item in dropped
+                if item.is_user_message
+            )
+            self.dropped_turns += 1
+            self.rewrites += 1
+            self._update_summary()
+
+        if self.dropped_turns == dropped_turns:
+            return
+        logger.info(
+            f"Dropped old turns to fit the history into {max_tokens} tokens "
+            f"({self.dropped_turns} dropped so far, {self.tokens} tokens left)"
+        )
+
+    def _update_summary(self) -> None:
+        text = ""
+        while self.summary:
+            text = "Earlier in the conversation, the user said: " + "; ".join(
+                f'"{message}"' for message in self.summary
+            )
+            if len(text) <= SUMMARY_MAX_CHARS:
+                break
+            self.summary.pop(0)
+        self.summary_item = (
+            self._item({"role": "system", "content": text}) if self.summary else None
+        )
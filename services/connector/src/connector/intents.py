@@ -0,0 +1,162 @@
+from dataclasses import dataclass, field
+from typing import Any, Iterable, Iterator, NamedTuple
+
+from .speculation import normalize_transcript
+
+
+class LocalCall(NamedTuple):
+    """A function call made without asking the LLM."""
+
+    name: str
+    arguments: dict[str, Any]
+
+
+# Commands in MIXING mode, normalized (see `normalize_transcript`)
+MIXING_INTENTS = {
+    **dict.fromkeys(
+        [
+            "weiter",
+            "geht weiter",
+            "nächster",
+            "nächster schritt",
+            "nächsten schritt",
+            "fertig",
+            "bin fertig",
+            "ich bin fertig",
+            "wir sind fertig",
+            "erledigt",
+            "gemacht",
+            "hab ich",
+            "habe ich",
+            "done",
+        ],
+        LocalCall("next_recipe_step", {}),
+    ),
+    # Only explicit ones: a bare "stopp" may just mean "stop talking" (see the
+    # stopwords in LLMNode), so that's left to the LLM
+    **dict.fromkeys(
+        [
+            "mixmodus beenden",
+            "rezept abbrechen",
+            "cocktail abbrechen",
+            "zubereitung abbrechen",
+        ],
+        LocalCall("stop_mixing_mode", {"grund": "Nutzer hat abgebrochen."}),
+    ),
+}
+# Words around commands that don't change their meaning, e.g. "ok, weiter bitte"
+FILLER_WORDS = {
+    "bitte",
+    "ok",
+    "okay",
+    "ja",
+    "jetzt",
+    "dann",
+    "und",
+    "so",
+    "mal",
+    "alles",
+    "zum",
+    "einfach",
+}
+# Real words one edit away from a command word, which mustn't be taken for it
+KNOWN_WORDS = {
+    "nächste",
+    "nächstes",
+    "nächstem",
+    "erledige",
+    "beendet",
+    "gemachte",
+}
+
+
+def within_one_edit(a: str, b: str) -> bool:
+    """Whether **a** and **b** differ by at most one insertion, deletion or substitution."""
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) > len(b):
+        a, b = b, a
+    for i, (x, y) in enumerate(zip(a, b)):
+        if x != y:
+            # Substitution, or insertion into the shorter word
+            return a[i + 1 :] == b[i + 1 :] or a[i:] == b[i + 1 :]
+    return True  # equal, or b has one more character at the end
+
+
+@dataclass
+class _TrieNode[T]:
+    children: dict[str, "_TrieNode[T]"] = field(default_factory=dict)
+    value: T | None = None
+
+
+class IntentMatcher[T]:
+    """
+    Matches short utterances against command phrases, e.g. "nächster Schritt".
+
+    Phrases are stored in a trie of words, so matching doesn't depend on the number
+    of phrases. An utterance matches if it's a phrase plus **fillers**, with at most
+    **max_words** words; a word is only skipped as filler if it doesn't continue the
+    phrase. Words of at least **fuzzy_min_length** characters may differ by one edit,
+    to tolerate transcription errors, unless they're real words: phrase words,
+    fillers and the **known_words**. Questions (e.g. "abbrechen?") never match.
+    """
+
+    root: _TrieNode[T]
+    fillers: set[str]
+    known_words: set[str]  # never matched fuzzily
+    max_words: int
+    fuzzy_min_length: int
+
+    def __init__(
+        self,
+        phrases: dict[str, T],
+        fillers: Iterable[str] = (),
+        known_words: Iterable[str] = (),
+        max_words: int = 5,
+        fuzzy_min_length: int = 7,
+    ) -> None:
+        self.root = _TrieNode()
+        self.fillers = set(fillers)
+        self.known_words = {*self.fillers, *known_words}
+        self.max_words = max_words
+        self.fuzzy_min_length = fuzzy_min_length
+
+        for phrase, value in phrases.items():
+            node = self.root
+            for word in normalize_transcript(phrase).split():
+                node = node.children.setdefault(word, _TrieNode())
+                self.known_words.add(word)
+            node.value = value
+
+    def match(self, text: str) -> T | None:
+        if text.rstrip().endswith("?"):
+            return None
+        words = normalize_transcript(text).split()
+        if len(words) > self.max_words:
+            return None
+        return self._match(self.root, words)
+
+    def _match(self, node: _TrieNode[T], words: list[str]) -> T | None:
+        if not words:
+            return node.value
+
+        word, rest = words[0], words[1:]
+        for child in self._children(node, word):
+            if (value := self._match(child, rest)) is not None:
+                return value
+        if word in self.fillers:
+            return self._match(node, rest)
+        return None
+
+    def _children(self, node: _TrieNode[T], word: str) -> Iterator[_TrieNode[T]]:
+        """Children of **node** that **word** leads to, the exact one first."""
+        if (child := node.children.get(word)) is not None:
+            yield child
+
+        if len(word) < self.fuzzy_min_length or word in self.known_words:
+            return
+        for candidate, child in node.children.items():
+            if len(candidate) >= self.fuzzy_min_length and within_one_edit(
+                candidate, word
+            ):
+                yield child
@@ -1,49 +1,62 @@
-import json
+import asyncio
+import logging
 from pathlib import Path
-from threading import Lock
-from typing import Any, Callable, List, NamedTuple, Optional
+from typing import Any, Callable, List, NamedTuple, Sequence
 
-from openai import OpenAI
-from openai.types.responses import ResponseFunctionToolCall, ResponseInputParam
+from openai import AsyncOpenAI, BadRequestError, NotFoundError
+from openai.types.responses import ResponseFunctionToolCall
+
+from .history import ConversationHistory
+
+logger = logging.getLogger(__name__)
 
 
 class LLMResponse(NamedTuple):
     text: str
     function_calls: List[ResponseFunctionToolCall]
+    output: Sequence[Any] = ()  # all output items, e.g. for `commit_response`
+    response_id: str | None = None
 
 
 class LLM:
     def __init__(
         self,
         system_prompt_path: Path,
-        tools_json_path: Path,
+        tools: list[dict[str, Any]],
         model: str = "gpt-4.1-mini",
-        api_key: str | None = None,
+        client: AsyncOpenAI | None = None,
+        max_history_tokens: int | None = None,
+        stateful: bool = False,
     ):
-        self.client = OpenAI(api_key=api_key)
+        """
+        Pass the same **client** to several LLMs so they share its connection pool.
+
+        If **stateful** is True, responses continue the previous response stored by
+        the API (`previous_response_id`), so only new history items are sent. The whole
+        history is sent again if that's not possible, e.g. after old turns were
+        dropped from the history.
+        """
+        self.client = client or AsyncOpenAI()
         self.model = model
-        self.lock = Lock()
+        self.lock = asyncio.Lock()
 
-        self.stream_callback: Optional[Callable[[str], None]] = None
+        self.stateful = stateful
+        self.previous_response_id: str | None = None
+        self.chain_length = 0  # history items the previous response includes
+        self.chain_rewrites = 0  # history rewrites when it was generated
 
         with open(system_prompt_path, "r", encoding="utf-8") as f:
             self.system_prompt = f.read()
 
-        self.history: ResponseInputParam = [
-            {
-                "role": "system",
-                "content": self.system_prompt,
-            }
-        ]
+        self.history = ConversationHistory(self.system_prompt, max_history_tokens)
 
-        with open(tools_json_path, "r", encoding="utf-8") as f:
-            print(tools_json_path)
-            self.tools = json.load(f)
+        self.tools = tools
 
-    def generate_response(
+    async def generate_response(
         self,
         message_content: str | None = None,
         stream_callback: Callable[[str], Any] | None = None,
+        commit: bool = True,
     ) -> LLMResponse:
         """
         Generate a response for the message passed.
@@ -53,52 +66,128 @@ class LLM:
         If **stream_callback** is passed, it will be called for each part of the output text of the LLM's response.
         Function calls need to be retrieved from the Response object that's returned after the entire response was completed.
 
+        If **commit** is False, neither the message nor the response are added to the history;
+        this can be done later with `commit_response` (e.g. for speculative responses).
+
+        Cancelling the call closes the stream (and its HTTP connection) right away.
+
         Note: Only one response can be generated at a time. This is ensured internally.
         """
 
-        self.lock.acquire()
-        try:
-            if message_content:
-                self.history.append(
-                    {
-                        "role": "user",
-                        "content": message_content,
-                    }
-                )
-
-            stream = self.client.responses.create(
-                model=self.model, input=self.history, tools=self.tools, stream=True
-            )
+        async with self.lock:
+            if commit and message_content:
+                self.history.add_user_message(message_content)
+                message_content = None  # already part of the history
+            rewrites = self.history.rewrites
+
+            if self.chain_valid:
+                try:
+                    stream = await self._create_stream(
+                        self.history.input(message_content, start=self.chain_length),
+                        self.previous_response_id,
+                    )
+                except (BadRequestError, NotFoundError) as e:
+                    # E.g. the previous response expired
+                    logger.warning(f"Could not continue previous response: {e}")
+                    self.invalidate_chain()
+            if not self.chain_valid:
+                stream = await self._create_stream(self.history.input(message_content))
 
             complete_response = None
-            for event in stream:
-                match event.type:
-                    case "response.created":
-                        if stream_callback:
-                            stream_callback(event.response.output_text)
+            async with stream:  # closes the stream when cancelled
+                async for event in stream:
+                    match event.type:
+                        case "response.created":
+                            if stream_callback:
+                                stream_callback(event.response.output_text)
 
-                    case "response.output_text.delta":
-                        if stream_callback:
-                            stream_callback(event.delta)
+                        case "response.output_text.delta":
+                            if stream_callback:
+                                stream_callback(event.delta)
 
-                    case "response.completed":
-                        complete_response = event.response
+                        case "response.completed":
+                            complete_response = event.response
 
-            function_calls = []
             assert complete_response is not None
+            if complete_response.usage is not None:
+                usage = complete_response.usage
+                logger.info(
+                    f"Prompt used {usage.input_tokens} tokens "
+                    f"({usage.input_tokens_details.cached_tokens} cached)"
+                )
 
-            for item in complete_response.output:
-                match item.type:
-                    case "message":
-                        self.history.append(item)  # type: ignore (this is a bug in the OpenAI library, see: https://github.com/openai/openai-python/issues/2323)
-                    case "function_call":
-                        self.history.append(item)  # type: ignore
-                        function_calls.append(item)
+            if commit:
+                self.history.add_output(complete_response.output)
+                self._continue_chain(complete_response.id, rewrites)
+            function_calls = [
+                item
+                for item in complete_response.output
+                if item.type == "function_call"
+            ]
+
+            return LLMResponse(
+                complete_response.output_text,
+                function_calls,
+                list(complete_response.output),
+                complete_response.id,
+            )
 
-            return LLMResponse(complete_response.output_text, function_calls)
+    @property
+    def chain_valid(self) -> bool:
+        """Whether the next response can continue the previous one."""
+        return (
+            self.stateful
+            and self.previous_response_id is not None
+            and self.history.rewrites == self.chain_rewrites
+        )
 
-        finally:
-            self.lock.release()
+    def invalidate_chain(self) -> None:
+        """Send the whole history with the next response."""
+        self.previous_response_id = None
+
+    def _continue_chain(self, response_id: str | None, rewrites: int) -> None:
+        # If the response was added to a rewritten history, the API's state differs
+        self.previous_response_id = response_id
+        self.chain_length = len(self.history)
+        self.chain_rewrites = rewrites
+
+    def _create_stream(self, input: list[Any], previous_response_id: str | None = None):
+        logger.info(
+            f"Prompt: {len(input)} new items"
+            if previous_response_id
+            else f"Prompt: {len(input)} items, ~{self.history.prompt_tokens} tokens"
+        )
+        # The system prompt and tools come first and never change, so the provider's
+        # prompt cache can hit on them
+        return self.client.responses.create(
+            model=self.model,
+            input=input,  # type: ignore (items are valid input params)
+            tools=self.tools,
+            previous_response_id=previous_response_id,
+            stream=True,
+        )
+
+    def commit_response(self, message_content: str | None, response: LLMResponse):
+        """
+        Appends a message and the response generated for it with `commit=False` to the history.
+        The history mustn't have changed since the response was requested.
+        """
+        rewrites = self.history.rewrites
+        if message_content:
+            self.history.add_user_message(message_content)
+        self.history.add_output(response.output)
+        self._continue_chain(response.response_id, rewrites)
+
+    def add_function_call(
+        self, message_content: str | None, function_call: ResponseFunctionToolCall
+    ):
+        """
+        Appends a message and a function call made for it without the LLM, as if the
+        LLM had made it. Its output is added with `add_function_call_output`.
+        """
+        if message_content:
+            self.history.add_user_message(message_content)
+        self.history.add_output([function_call])
 
     def add_function_call_output(
         self, output: str, function_call: ResponseFunctionToolCall
@@ -107,22 +196,11 @@ class LLM:
         Appends the result of the function to the history.
         Does NOT generate a response.
         """
-        self.history.append(
-            {
-                "type": "function_call_output",
-                "call_id": function_call.call_id,
-                "output": output,
-            }
-        )
+        self.history.add_function_call_output(output, function_call)
 
     def add_system_message(self, message: str):
         """
         Appends a system message to the history.
         Does NOT generate a response.
         """
-        self.history.append(
-            {
-                "role": "system",
-                "message": message,
-            }  # type: ignore (see above)
-        )
+        self.history.add_system_message(message)
@@ -2,24 +2,46 @@ from typing import Literal, Optional, Union
 
 from pydantic import BaseModel, ConfigDict, Field
 
+# The models define the tools' parameters (see tools.py); their docstrings and
+# descriptions are part of the prompt, so they're in German like the prompts.
+
 
 class InstructionStep(BaseModel):
-    """A general instruction, e.g., 'Kräftig schütteln'."""
+    """Allgemeiner Zubereitungsschritt ohne abgemessene Zutat, z.B. 'Kräftig schütteln'."""
 
-    typ: Literal["anweisung"]
-    beschreibung: str = Field(..., min_length=1)
+    typ: Literal["anweisung"] = Field(
+        ..., description="Typ des Schritts muss 'anweisung' sein."
+    )
+    beschreibung: str = Field(
+        ...,
+        min_length=1,
+        description="Benutzerfreundliche Anweisung, z.B. 'Kräftig schütteln'.",
+    )
 
     model_config = ConfigDict(extra="forbid")
 
 
 class IngredientStep(BaseModel):
-    """An instruction that entails a certain ingredient being added."""
-
-    typ: Literal["zutat"]
-    beschreibung: str = Field(..., min_length=1)
-    name: str = Field(..., min_length=1)
-    menge: Optional[int | float] = None  # Allows int, float, and None
-    einheit: Optional[str] = None
+    """Zubereitungsschritt, bei dem eine abgemessene Zutat hinzugefügt wird."""
+
+    typ: Literal["zutat"] = Field(
+        ..., description="Typ des Schritts muss 'zutat' sein."
+    )
+    beschreibung: str = Field(
+        ...,
+        min_length=1,
+        description="Benutzerfreundliche Anweisung, z.B. '4 cl weißen Rum hinzufügen'.",
+    )
+    name: str = Field(
+        ..., min_length=1, description="Name der Zutat, z.B. 'Weißer Rum'."
+    )
+    menge: Optional[int | float] = Field(
+        None, description="Numerische Menge. Null, wenn nicht anwendbar."
+    )
+    einheit: Optional[str] = Field(
+        None,
+        description="Einheit der Menge, z.B. 'cl'. Null, wenn nicht anwendbar.",
+    )
 
     model_config = ConfigDict(extra="forbid")
 
@@ -28,17 +50,44 @@ Step = Union[IngredientStep, InstructionStep]
 
 
 class Recipe(BaseModel):
-    name: str = Field(..., min_length=1)
-    schritte: list[Step] = Field(..., min_length=1)
+    """Das vollständige Rezeptobjekt für die Zubereitung."""
+
+    name: str = Field(..., min_length=1, description="Name des Cocktails.")
+    schritte: list[Step] = Field(
+        ..., min_length=1, description="Array aller Zubereitungsschritte."
+    )
 
 
 class StartMixingArguments(BaseModel):
+    """
+    Startet den Mixmodus für ein vom Benutzer explizit ausgewähltes und bestätigtes
+    Cocktailrezept. Nur nach klarer Nutzerbestätigung aufrufen.
+    """
+
     rezept: Recipe
 
     model_config = ConfigDict(extra="forbid")
 
 
 class StopMixingArguments(BaseModel):
-    grund: str
+    """
+    Beendet den Mixmodus und wechselt zurück zum RECIPE_SEARCH-Modus. Wird aufgerufen
+    wenn der Nutzer abbricht, ein Fehler auftritt, oder das Rezept erfolgreich
+    abgeschlossen wurde.
+    """
+
+    grund: str = Field(
+        ...,
+        description="Grund für das Beenden des Mixmodus und eine kurze Zusammenfassung des Geschehenen, z.B. 'Cocktail erfolgreich zubereitet' oder 'Nutzer hat abgebrochen' oder 'Fehler bei Schritt 3 aufgetreten'.",
+    )
+
+    model_config = ConfigDict(extra="forbid")
+
+
+class NextRecipeStepArguments(BaseModel):
+    """
+    Initiiert den nächsten Schritt des aktuellen Cocktailrezepts. Wird aufgerufen um
+    das System anzuweisen, mit dem nächsten Zubereitungsschritt fortzufahren.
+    """
 
     model_config = ConfigDict(extra="forbid")
@@ -1,12 +1,111 @@
+import asyncio
 import logging
-from typing import Any, Callable
+from enum import Enum
+from typing import Any, Callable, Iterable
+
+from ..audio import AudioFrame
 
 logger = logging.getLogger(__name__)
 
 
+class OverflowPolicy(Enum):
+    BLOCK = "block"
+    DROP_OLDEST = "drop_oldest"
+    DROP_NEWEST = "drop_newest"
+
+
+class Edge[T]:
+    """
+    A scheduled connection between two nodes.
+
+    Data sent over the edge is put into a bounded queue and handed to the receiving
+    node by a worker task, so a slow receiver doesn't stall the sender.
+    If the queue is full, the overflow policy decides what happens:
+
+    - BLOCK: the sender delivers queued data itself until there is room again
+    - DROP_OLDEST: the oldest queued data is discarded
+    - DROP_NEWEST: the new data is discarded
+    """
+
+    sender: "Node[Any, T]"
+    receiver: "Node[T, Any]"
+    policy: OverflowPolicy
+    queue: asyncio.Queue[T]
+    worker: asyncio.Task[None] | None = None
+
+    dropped: int = 0
+    max_depth: int = 0
+
+    def __init__(
+        self,
+        sender: "Node[Any, T]",
+        receiver: "Node[T, Any]",
+        maxsize: int,
+        policy: OverflowPolicy = OverflowPolicy.DROP_OLDEST,
+    ) -> None:
+        self.sender = sender
+        self.receiver = receiver
+        self.policy = policy
+        self.queue = asyncio.Queue(maxsize)
+
+    def __str__(self) -> str:
+        return f"{self.sender} -> {self.receiver}"
+
+    @property
+    def depth(self) -> int:
+        return self.queue.qsize()
+
+    def stats(self) -> str:
+        return f"{self}: depth {self.depth}/{self.queue.maxsize} (max {self.max_depth}), dropped {self.dropped}"
+
+    def put(self, data: T) -> None:
+        if self.worker is None:
+            self.worker = asyncio.get_running_loop().create_task(
+                self._work(), name=str(self)
+            )
+
+        if self.queue.full():
+            match self.policy:
+                case OverflowPolicy.BLOCK:
+                    self._deliver(self.queue.get_nowait())
+                    self.queue.task_done()
+                case OverflowPolicy.DROP_OLDEST:
+                    self.queue.get_nowait()
+                    self.queue.task_done()
+                    self.dropped += 1
+                case OverflowPolicy.DROP_NEWEST:
+                    self.dropped += 1
+                    return
+
+        self.queue.put_nowait(data)
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+
+    def close(self) -> None:
+        """Stop the worker task; queued data is discarded."""
+        if self.worker is not None:
+            self.worker.cancel()
+            self.worker = None
+
+    def _deliver(self, data: T) -> None:
+        try:
+            self.receiver.input(data, self.sender)
+        except Exception:
+            logger.exception(f"Edge {self}: receiver raised while handling input")
+
+    async def _work(self) -> None:
+        while True:
+            data = await self.queue.get()
+            self._deliver(data)
+            self.queue.task_done()
+            # Queue.get() doesn't suspend while data is available: yield once per item,
+            # so a busy edge can't starve the rest of the loop
+            await asyncio.sleep(0)
+
+
 class Node[In, Out]:
     name: str
     outgoing_nodes: set["Node[Out, Any]"]
+    edges: dict["Node[Out, Any]", Edge[Out]]
     default_logging_level: int = logging.DEBUG
 
     def __init__(
@@ -14,6 +113,7 @@ class Node[In, Out]:
     ) -> None:
         self.name = node_name
         self.outgoing_nodes = set()
+        self.edges = {}
         self.default_logging_level = default_logging_level
 
     def __str__(self) -> str:
@@ -27,23 +127,50 @@ class Node[In, Out]:
     ) -> None:
         logger.log(level, log_format.format_map(locals()))
 
-    def add_outgoing_node(self, other: "Node[Any, Any]") -> None:
+    def add_outgoing_node(
+        self,
+        other: "Node[Any, Any]",
+        queue_size: int | None = None,
+        overflow: OverflowPolicy = OverflowPolicy.DROP_OLDEST,
+    ) -> None:
         """
         Add an outgoing connection to another node.
 
         The other node's input type must be compatible with this node's
         output type. This means if this node outputs type Out, the other
         node must accept Out (possibly as part of a Union).
+
+        By default, the other node's input is called synchronously from `output`.
+        If **queue_size** is passed, the connection is scheduled instead: data is
+        queued (at most **queue_size** items, see `Edge`) and delivered by a
+        worker task. Scheduled connections must be fed from the event loop.
         """
 
         self.outgoing_nodes.add(other)
+        if queue_size is not None:
+            self.edges[other] = Edge(self, other, queue_size, overflow)
+
+    def close_edges(self) -> None:
+        """Stop the worker tasks of the scheduled connections (e.g. on shutdown)."""
+        for edge in self.edges.values():
+            edge.close()
+
+    def queue_depths(self) -> dict[str, int]:
+        return {str(edge): edge.depth for edge in self.edges.values()}
 
     def input(self, data: In, sender: "Node[Any, In]") -> None:
         self._log(f"Received data from {sender}")
         self.handle_input(data)
 
     def output(self, data: Out) -> None:
+        if len(self.outgoing_nodes) > 1 and isinstance(data, AudioFrame):
+            data.share()  # no receiver may modify it in place anymore
+
         for node in self.outgoing_nodes:
+            if (edge := self.edges.get(node)) is not None:
+                edge.put(data)
+                continue
+
             self._log(f"Running callback for node {node}")
             node.input(data, self)
 
@@ -60,3 +187,12 @@ class FnNode[In, Out](Node[In, Out]):
 
     def handle_input(self, data: In) -> None:
         self.fn(data)
+
+
+async def log_edge_stats(nodes: Iterable[Node[Any, Any]], interval: float) -> None:
+    """Periodically log the queue depth of every scheduled edge of **nodes**."""
+    while True:
+        await asyncio.sleep(interval)
+        for node in nodes:
+            for edge in node.edges.values():
+                logger.info(f"Edge {edge.stats()}")
@@ -0,0 +1,43 @@
+import numpy as np
+
+from ..audio import AudioFrame
+from ..dsp import INT16_MAX, INT16_MIN, Stage
+from .base import Node
+
+
+class DSPNode(Node[AudioFrame, AudioFrame]):
+    """
+    Runs a chain of `Stage`s over each (mono) frame.
+
+    The samples are converted to float32 once, processed in place by every stage,
+    then clipped to the int16 range (saturating instead of wrapping around)
+    and written back into the frame.
+    """
+
+    stages: list[Stage]
+    scratch: np.ndarray
+
+    def __init__(self, name: str, stages: list[Stage]) -> None:
+        self.stages = stages
+        self.scratch = np.empty(0, np.float32)
+        super().__init__(name)
+
+    def reset(self) -> None:
+        for stage in self.stages:
+            stage.reset()
+
+    def handle_input(self, data: AudioFrame) -> None:
+        frame = data.writable()
+        n = len(frame.samples)
+
+        if len(self.scratch) < n:
+            self.scratch = np.empty(n, np.float32)
+        buf = self.scratch[:n]
+
+        np.copyto(buf, frame.samples)
+        for stage in self.stages:
+            stage.process(buf, frame.sample_rate)
+        np.clip(buf, INT16_MIN, INT16_MAX, out=buf)
+        np.copyto(frame.samples, buf, casting="unsafe")
+
+        self.output(frame)
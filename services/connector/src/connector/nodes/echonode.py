@@ -0,0 +1,164 @@
+import numpy as np
+
+from ..aec import DelayEstimator, PartitionedFDAF
+from ..audio import AudioFrame
+from ..dsp import INT16_MAX, INT16_MIN
+from ..resample import PolyphaseResampler
+from ..ringbuffer import OverrunPolicy, RingBuffer
+from .base import Node
+
+
+class EchoReference(Node[AudioFrame, None]):
+    """Receives the audio sent to the speaker and hands it to its `EchoCanceller`."""
+
+    canceller: "EchoCanceller"
+
+    def __init__(self, name: str, canceller: "EchoCanceller") -> None:
+        self.canceller = canceller
+        super().__init__(name)
+
+    def handle_input(self, data: AudioFrame) -> None:
+        self.canceller.add_reference(data)
+
+
+class EchoCanceller(Node[AudioFrame, AudioFrame]):
+    """
+    Removes the robot's own voice from the (mono) microphone signal.
+
+    Connect the audio sent to the speaker to `reference`. It is resampled to the
+    microphone's rate and consumed in step with the microphone samples, a
+    `DelayEstimator` measures the remaining delay until it is picked up as echo,
+    and a `PartitionedFDAF` subtracts the echo from the delay-aligned microphone
+    signal. Audio is processed in blocks of **block_size** samples, which adds
+    that much latency to the microphone path.
+    """
+
+    reference: EchoReference
+    sample_rate: int
+    block_size: int
+
+    filter: PartitionedFDAF
+    delay_estimator: DelayEstimator
+    estimate_interval: int  # blocks between delay estimates
+    blocks_until_estimate: int
+    delay: int = 0
+
+    pending_reference: RingBuffer
+    reference_resamplers: dict[int, PolyphaseResampler]
+    reference_history: np.ndarray  # last samples taken from pending_reference
+    mic_history: np.ndarray
+    mic_block: np.ndarray
+    mic_fill: int = 0
+    mic_timestamp_ns: int = 0
+
+    def __init__(
+        self,
+        name: str,
+        sample_rate: int,
+        block_size: int = 128,
+        partitions: int = 8,
+        max_delay: float = 0.25,
+        estimate_interval: float = 0.5,
+        max_pending_reference: float = 30.0,
+    ) -> None:
+        self.reference = EchoReference(f"{name} Reference", self)
+        self.sample_rate = sample_rate
+        self.block_size = block_size
+
+        self.filter = PartitionedFDAF(block_size, partitions)
+        window = sample_rate // 2
+        max_delay_samples = int(max_delay * sample_rate)
+        self.delay_estimator = DelayEstimator(max_delay_samples, window)
+        self.estimate_interval = max(
+            1, int(estimate_interval * sample_rate) // block_size
+        )
+        self.blocks_until_estimate = self.estimate_interval
+
+        self.pending_reference = RingBuffer(
+            int(max_pending_reference * sample_rate),
+            np.float32,
+            OverrunPolicy.DROP_OLDEST,
+        )
+        self.reference_resamplers = {}
+        self.reference_history = np.zeros(
+            window + max_delay_samples + block_size, np.float32
+        )
+        self.mic_history = np.zeros(window, np.float32)
+        self.mic_block = np.zeros(block_size, np.float32)
+
+        super().__init__(name)
+
+    def reset(self) -> None:
+        self.filter.reset()
+        self.pending_reference.clear()
+        self.reference_history[:] = 0
+
+    def add_reference(self, frame: AudioFrame) -> None:
+        samples = frame.samples
+        if frame.sample_rate != self.sample_rate:
+            if (resampler := self.reference_resamplers.get(frame.sample_rate)) is None:
+                resampler = self.reference_resamplers[frame.sample_rate] = (
+                    PolyphaseResampler(frame.sample_rate, self.sample_rate)
+                )
+            samples = resampler.process(samples)
+
+        self.pending_reference.write(samples)
+
+    def handle_input(self, data: AudioFrame) -> None:
+        samples = data.samples
+        while len(samples) > 0:
+            n = min(len(samples), self.block_size - self.mic_fill)
+            self.mic_block[self.mic_fill : self.mic_fill + n] = samples[:n]
+            self.mic_fill += n
+            self.mic_timestamp_ns = data.timestamp_ns
+            samples = samples[n:]
+
+            if self.mic_fill == self.block_size:
+                self.mic_fill = 0
+                self.process_block(data.channels)
+
+    def process_block(self, channels: int) -> None:
+        n = self.block_size
+
+        # Advance the reference in step with the microphone, silence if there is none
+        self.reference_history[:-n] = self.reference_history[n:]
+        new_reference = self.reference_history[-n:]
+        new_reference[self.pending_reference.read_into(new_reference) :] = 0
+
+        self.mic_history[:-n] = self.mic_history[n:]
+        self.mic_history[-n:] = self.mic_block
+
+        self.blocks_until_estimate -= 1
+        if self.blocks_until_estimate == 0:
+            self.blocks_until_estimate = self.estimate_interval
+            self.estimate_delay()
+
+        end = len(self.reference_history) - self.delay
+        aligned_reference = self.reference_history[end - n : end]
+        out = self.filter.process(aligned_reference, self.mic_block)
+
+        np.clip(out, INT16_MIN, INT16_MAX, out=out)
+        self.output(
+            AudioFrame(
+                out.astype(np.int16),
+                self.sample_rate,
+                channels,
+                self.mic_timestamp_ns,
+            )
+        )
+
+    def estimate_delay(self) -> None:
+        window = len(self.mic_history)
+        reference = self.reference_history[-(window + self.delay_estimator.max_delay) :]
+        if not np.any(reference[-window:]):
+            return
+
+        delay = self.delay_estimator.update(self.mic_history, reference)
+        if delay is None:
+            return
+
+        # Keep a little margin so the start of the echo path stays inside the filter
+        delay = max(0, delay - self.block_size // 4)
+        self._log(f"Echo delay changed to {delay / self.sample_rate * 1000:.1f} ms")
+        self.delay = delay
+        self.filter.reset()
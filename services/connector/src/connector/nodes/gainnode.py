@@ -1,16 +1,20 @@
-import numpy as np
+from ..dsp import GainStage
+from .dspnode import DSPNode
 
-from .streamnode import Node
 
+class Gain(DSPNode):
+    """Multiplies all samples by a constant factor, saturating at the int16 range."""
 
-class Gain(Node[bytes, bytes]):
-    gain: float
+    gain_stage: GainStage
 
     def __init__(self, gain: float, task_name: str) -> None:
-        self.gain = gain
-        super().__init__(task_name)
+        self.gain_stage = GainStage(gain)
+        super().__init__(task_name, [self.gain_stage])
 
-    def handle_input(self, data: bytes) -> None:
-        adjusted = (np.frombuffer(data, np.int16) * self.gain).astype(np.int16)
-        out_bytes = adjusted.tobytes()
-        self.output(out_bytes)
+    @property
+    def gain(self) -> float:
+        return self.gain_stage.gain
+
+    @gain.setter
+    def gain(self, gain: float) -> None:
+        self.gain_stage.gain = gain
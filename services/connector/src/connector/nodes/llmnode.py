@@ -1,14 +1,23 @@
 import asyncio
+import json
 import logging
-import string
-from datetime import timedelta
+from collections import Counter
 from enum import Enum
 from typing import Any, List
+from uuid import uuid4
 
+from openai import AsyncOpenAI
 from openai.types.responses import ResponseFunctionToolCall
-from pydantic import ValidationError
+from pydantic import BaseModel, ValidationError
 
 from ..config import settings
+from ..intents import (
+    FILLER_WORDS,
+    KNOWN_WORDS,
+    MIXING_INTENTS,
+    IntentMatcher,
+    LocalCall,
+)
 from ..llm import LLM, LLMResponse
 from ..mixmode_types import (
     IngredientStep,
@@ -16,7 +25,13 @@ from ..mixmode_types import (
     StartMixingArguments,
     StopMixingArguments,
 )
+from ..prefetch import PhrasePrefetcher
+from ..repair import parse_arguments
+from ..segmenter import ClauseSegmenter
+from ..speculation import Speculation, normalize_transcript
 from ..state import Mode, State, StateError
+from ..sttprotocol import ResultType, STTResult
+from ..tools import MIXING_TOOLS, RECIPE_SEARCH_TOOLS
 from .base import Node
 from .controlnode import ESPControlNode
 from .streamnode import TTSStream
@@ -27,14 +42,21 @@ class MixingEvent(Enum):
     TARGET_WEIGHT_SURPASSED = 1
 
 
-class LLMNode(Node[str | MixingEvent, str]):
+class LLMNode(Node[STTResult | MixingEvent, str]):
     state: State
-    sentence_queue: asyncio.Queue[str]
+    sentence_queue: asyncio.Queue[STTResult]
     mixing_event_queue: asyncio.Queue[MixingEvent]
-    current_llm_future: asyncio.Future[LLMResponse] | None = None
+    turns: set[asyncio.Task[None]]  # responses and their function calls
+    function_call_stats: Counter[str]  # calls, repairs, retries, ...
+
+    # Speculative response to the current utterance's partial transcript
+    speculation: Speculation | None = None
+    partial_text: str = ""  # normalized
+    partial_timer: asyncio.TimerHandle | None = None
 
     tts_node: TTSStream
     esp_control_node: ESPControlNode
+    prefetcher: PhrasePrefetcher
 
     def __init__(
         self, name: str, tts_node: TTSStream, esp_control_node: ESPControlNode
@@ -42,35 +64,47 @@ class LLMNode(Node[str | MixingEvent, str]):
         super().__init__(name, default_logging_level=logging.INFO)
         self.tts_node = tts_node
         self.esp_control_node = esp_control_node
+        self.prefetcher = PhrasePrefetcher(
+            tts_node, lookahead=settings.PHRASE_PREFETCH_LOOKAHEAD
+        )
 
+        # Shared, so both LLMs reuse the same (kept alive) connections
+        client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
         llm_recipe_search = LLM(
             settings.RESOURCES_DIR / "RECIPE_SEARCH" / "system_prompt.md",
-            settings.RESOURCES_DIR / "RECIPE_SEARCH" / "tools.json",
+            RECIPE_SEARCH_TOOLS,
             model=settings.OPENAI_MODEL,
-            api_key=settings.OPENAI_API_KEY,
+            client=client,
+            max_history_tokens=settings.LLM_HISTORY_MAX_TOKENS,
+            stateful=settings.LLM_STATEFUL,
         )
         llm_mixing = LLM(
             settings.RESOURCES_DIR / "MIXING" / "system_prompt.md",
-            settings.RESOURCES_DIR / "MIXING" / "tools.json",
+            MIXING_TOOLS,
             model=settings.OPENAI_MODEL,
-            api_key=settings.OPENAI_API_KEY,
+            client=client,
+            max_history_tokens=settings.LLM_HISTORY_MAX_TOKENS,
+            stateful=settings.LLM_STATEFUL,
         )
 
         self.state = State(llm_recipe_search, llm_mixing)
         self.state.init_recipe_search_mode()
 
+        self.turns = set()
+        self.function_call_stats = Counter()
         self.sentence_queue = asyncio.Queue()
         self.mixing_event_queue = asyncio.Queue()
         self.user_event_queue = asyncio.Queue()
 
-        self.stopwords = [
+        self.stopwords = {
             "stop",
             "stopp",
             "stoppe",
             "abort",
             "aufhören",
-        ]
+        }
         self.current_blacklist = []
+        self.intents = IntentMatcher(MIXING_INTENTS, FILLER_WORDS, KNOWN_WORDS)
 
         self.func_call_handler_map = {
             Mode.RECIPE_SEARCH: {
@@ -83,11 +117,14 @@ class LLMNode(Node[str | MixingEvent, str]):
         }
 
     def input(
-        self, data: str | MixingEvent, sender: Node[Any, str | MixingEvent]
+        self, data: STTResult | MixingEvent, sender: Node[Any, STTResult | MixingEvent]
     ) -> None:
-        if sender.name == "STT" and isinstance(data, str):
+        if sender.name == "STT" and isinstance(data, STTResult):
             self._log("Received data from STT")
-            self.sentence_queue.put_nowait(data)
+            if data.is_final:
+                self.sentence_queue.put_nowait(data)
+            elif data.type == ResultType.PARTIAL and settings.LLM_SPECULATION:
+                self.on_partial(data)
 
         elif sender.name == "scale" and isinstance(data, MixingEvent):
             self._log("Received data from scale")
@@ -107,7 +144,8 @@ class LLMNode(Node[str | MixingEvent, str]):
         step = self.state.current_recipe.schritte[self.state.current_step]
 
         print("Should output to TTS here ...")
-        self.output(step.beschreibung)  # TTS
+        self.say(step.beschreibung)  # TTS
+        self.prefetcher.advance(self.state.current_step + 1)
         # TODO: setup scale (check)
         self.esp_control_node.zeroScale()
         # # TODO: show instruction on display (redo controlnode and check)
@@ -134,13 +172,14 @@ class LLMNode(Node[str | MixingEvent, str]):
             self.state.last_call_to_mixmode is not None
         )  # always set when in Mode.MIXING
 
-        self.output("DONE")
+        self.say("DONE")
         self.state._llm_recipe_search.add_function_call_output(
             output=reason,
             function_call=self.state.last_call_to_mixmode,
         )
 
         self.state.init_recipe_search_mode()
+        self.prefetcher.clear()
 
     class StepResult(Enum):
         ADVANCED = "advanced"
@@ -153,7 +192,7 @@ class LLMNode(Node[str | MixingEvent, str]):
             raise StateError(msg)
         assert self.state.current_recipe is not None
 
-        if self.state.current_step >= len(self.state.current_recipe.schritte):
+        if self.state.current_step + 1 >= len(self.state.current_recipe.schritte):
             self.stop_mixing_mode(reason="Das Rezept wurde erfolgreich zubereitet.")
             return LLMNode.StepResult.FINISHED
         else:
@@ -161,9 +200,11 @@ class LLMNode(Node[str | MixingEvent, str]):
             self.give_mixing_instructions()
             return LLMNode.StepResult.ADVANCED
 
-    def handle_start_mixing_mode_call(self, call: ResponseFunctionToolCall) -> str:
+    def parse_arguments[T: BaseModel](
+        self, model: type[T], call: ResponseFunctionToolCall
+    ) -> T:
         try:
-            args = StartMixingArguments.model_validate_json(call.arguments)
+            args, repairs = parse_arguments(model, call.arguments)
         except ValidationError as e:
             self._log(
                 f"Error while parsing or validating function call to '{call.name}': {e}",
@@ -171,21 +212,26 @@ class LLMNode(Node[str | MixingEvent, str]):
             )
             raise e
 
+        if repairs:
+            self.function_call_stats["repaired"] += 1
+            self._log(
+                f"Repaired arguments of function call to '{call.name}': {', '.join(repairs)}",
+                logging.INFO,
+            )
+        return args
+
+    def handle_start_mixing_mode_call(self, call: ResponseFunctionToolCall) -> str:
+        args = self.parse_arguments(StartMixingArguments, call)
+
         self.state.init_mixing_mode(args.rezept, call)
+        self.prefetcher.start([step.beschreibung for step in args.rezept.schritte])
         self.esp_control_node.startRecipe(args.rezept.name)
         self.give_mixing_instructions()
 
         return "Mixing mode started"
 
     def handle_stop_mixing_mode_call(self, call: ResponseFunctionToolCall) -> str:
-        try:
-            args = StopMixingArguments.model_validate_json(call.arguments)
-        except ValidationError as e:
-            self._log(
-                f"Error while parsing or validating function call to '{call.name}': {e}",
-                logging.WARNING,
-            )
-            raise e
+        args = self.parse_arguments(StopMixingArguments, call)
 
         self.stop_mixing_mode(reason=args.grund)
 
@@ -201,18 +247,13 @@ class LLMNode(Node[str | MixingEvent, str]):
             case LLMNode.StepResult.FINISHED:
                 return "No steps left; recipe now finished."
 
-    def _dispatch_function_calls_recursion(
-        self, function_calls: List[ResponseFunctionToolCall], attempts_left: int
-    ) -> None:
-        if attempts_left == 0:
-            self._log(
-                f"LLM used all attempts for function call {function_calls[0].name}"
-            )
-            return
-        attempts_left -= 1
-
-        if len(function_calls) == 0:
-            return
+    def _run_function_calls(
+        self, function_calls: List[ResponseFunctionToolCall]
+    ) -> bool:
+        """
+        Runs the handler of the first function call. Returns whether the LLM should be
+        asked again, as the call failed.
+        """
         if len(function_calls) > 1:
             self._log(
                 f"LLM tried calling multiple functions at once. Only executing the first one ('{function_calls[0].name}') ..."
@@ -231,92 +272,268 @@ class LLMNode(Node[str | MixingEvent, str]):
         if call_handler is None:
             msg = f"LLM tried calling '{call.name}' which doesn't exist (in mode {self.state.current_mode})"
             self._log(msg, level=logging.WARNING)
-
             self.state.current_llm.add_function_call_output(msg, call)
+            return True
 
-            response = self.state.current_llm.generate_response()
-            self._dispatch_function_calls_recursion(
-                response.function_calls, attempts_left
-            )
-
-            return
-
-        self._log(f"LLM made function call to '{call.name}'", level=logging.INFO)
+        self._log(f"Running function call to '{call.name}'", level=logging.INFO)
+        self.function_call_stats["calls"] += 1
         calling_llm = self.state.current_llm
         try:
-            print("Calling ...")
             result = call_handler(call)
         except (StateError, ValidationError) as e:
             calling_llm.add_function_call_output(str(e), call)
-
-            if self.state.current_llm != calling_llm:
-                return  # don't retry
-
-            response = self.state.current_llm.generate_response()
-            self._dispatch_function_calls_recursion(
-                response.function_calls, attempts_left
-            )
+            return self.state.current_llm == calling_llm  # else don't retry
+        except Exception as e:
+            # The API rejects requests with a call that has no output
+            self._log(f"Function call to '{call.name}' failed: {e!r}", logging.ERROR)
+            calling_llm.add_function_call_output(f"Internal error: {e}", call)
+            return False
         else:
             calling_llm.add_function_call_output(result, call)
+            return False
 
-    def dispatch_function_calls(
+    async def dispatch_function_calls(
         self, function_calls: List[ResponseFunctionToolCall], max_attempts: int = 3
     ) -> None:
-        self._dispatch_function_calls_recursion(function_calls, max_attempts)
+        """
+        Runs the handlers of **function_calls**. If a call fails (e.g. it has invalid
+        arguments), the error is passed to the LLM and the calls of its new response
+        are dispatched, at most **max_attempts** times.
+
+        Handlers are synchronous and don't wait for the ESP, so only the LLM requests
+        are awaited, within the deadline of the turn.
+        """
+        for _ in range(max_attempts):
+            if not function_calls or not self._run_function_calls(function_calls):
+                return
+            self.function_call_stats["retries"] += 1
+            self._log(
+                f"Asking LLM to retry function call ({dict(self.function_call_stats)})",
+                logging.INFO,
+            )
+            response = await self.generate(self.state.current_llm)
+            function_calls = response.function_calls
+
+        if function_calls:
+            self.function_call_stats["exhausted"] += 1
+            self._log(
+                f"LLM used all attempts for function call {function_calls[0].name}"
+            )
+
+    @property
+    def is_busy(self) -> bool:
+        return any(not turn.done() for turn in self.turns)
 
     def stop_talking(self) -> None:
         self.current_blacklist = []
-        self.tts_node.stop_flag = True
-        if self.current_llm_future is not None:
-            self.current_llm_future.cancel()
+        self.tts_node.stop()
+        for turn in self.turns:
+            turn.cancel()
+        self.discard_speculation()
+
+    def is_muted(self, result: STTResult) -> bool:
+        """Whether the robot talked while the user did (or shortly before)."""
+        slack_ns = int(settings.STT_MUTE_SLACK * 1e9)
+        return self.tts_node.timeline.was_playing(
+            result.start_ns - slack_ns, result.end_ns
+        )
 
-    def output(self, data: str) -> None:
-        self.tts_node.stop_flag = False
+    def on_partial(self, result: STTResult) -> None:
+        text = normalize_transcript(result.text)
+        if (
+            self.speculation is not None
+            and normalize_transcript(self.speculation.message) != text
+        ):
+            self.discard_speculation()
+
+        if text and text != self.partial_text:
+            # Speculate once the hypothesis hasn't changed for a while
+            self.partial_text = text
+            if self.partial_timer is not None:
+                self.partial_timer.cancel()
+            self.partial_timer = asyncio.get_running_loop().call_later(
+                settings.LLM_SPECULATION_WINDOW, self.speculate, result
+            )
+
+    def speculate(self, result: STTResult) -> None:
+        self.partial_timer = None
+        if (
+            self.speculation is not None
+            or self.is_busy
+            or not self.sentence_queue.empty()
+            or self.is_muted(result)
+            or self.match_intent(result.text) is not None  # answered without the LLM
+        ):
+            return
+
+        self._log(f"Speculating on partial transcript '{result.text}'")
+        self.speculation = Speculation(
+            self.state.current_llm, result.utterance_id, result.text
+        )
+
+    def discard_speculation(self) -> None:
+        if self.speculation is not None:
+            self._log(f"Discarding speculation on '{self.speculation.message}'")
+            self.speculation.discard()
+            self.speculation = None
+
+    def _blacklist_stopwords(self, text: str) -> None:
+        # Stopwords the robot says itself mustn't stop it
         self.current_blacklist.extend(
             [
                 word
-                for word in data.lower().strip(string.punctuation).split(" ")
+                for word in normalize_transcript(text).split()
                 if word in self.stopwords
             ]
         )
-        super().output(data)
 
-    async def await_sentence(self) -> None:
-        sentence = await self.sentence_queue.get()
+    def output(self, data: str) -> None:
+        self._blacklist_stopwords(data)
+        super().output(data)
 
-        if self.tts_node.is_broadcasting(timedelta(seconds=2)):
-            self._log("TTS is brodcasting, skipping input ...", level=logging.INFO)
-            for stopword in [
-                word for word in self.stopwords if word not in self.current_blacklist
-            ]:
-                if stopword in sentence.lower():
-                    self.stop_talking()
-                    return
-            return
+    def say(self, phrase: str) -> None:
+        """Say a fixed phrase, which may be played from the TTS phrase cache."""
+        self._blacklist_stopwords(phrase)
+        self.tts_node.say(phrase)
+
+    async def generate(
+        self,
+        llm: LLM,
+        message: str | None = None,
+        speculation: Speculation | None = None,
+    ) -> LLMResponse:
+        """
+        Generates a response to **message** (or uses the **speculation** on it), whose
+        text is coalesced into clauses and sent to the TTS clause by clause.
+        """
+        segmenter = ClauseSegmenter(
+            self.output,
+            min_length=settings.TTS_SEGMENT_MIN_LENGTH,
+            max_delay=settings.TTS_SEGMENT_MAX_DELAY,
+        )
+        self.current_blacklist = []
+        try:
+            if speculation is not None:
+                self._log("Using speculative response", logging.INFO)
+                speculation.commit(segmenter.feed)
+                response = await speculation.future
+                llm.commit_response(speculation.message, response)
+            else:
+                response = await llm.generate_response(message, segmenter.feed)
+        except (asyncio.CancelledError, TimeoutError):
+            # The stream was closed, drop what's left of the current clause
+            segmenter.close()
+            raise
+        segmenter.flush()
 
-        mode = self.state.current_mode
+        self._log(f'LLM responded: "{response.text}"', logging.INFO)
+        return response
+
+    def match_intent(self, text: str) -> LocalCall | None:
+        """The function to call for a short command, which doesn't need the LLM."""
+        if not settings.LLM_LOCAL_INTENTS or self.state.current_mode != Mode.MIXING:
+            return None
+        return self.intents.match(text)
+
+    def make_local_call(
+        self, llm: LLM, message: str, local_call: LocalCall
+    ) -> ResponseFunctionToolCall:
+        """
+        Creates the function call for a command and adds it to the history of **llm**,
+        so its context is the same as if it had made the call.
+        """
+        call = ResponseFunctionToolCall(
+            type="function_call",
+            call_id=f"local_{uuid4().hex}",
+            name=local_call.name,
+            arguments=json.dumps(local_call.arguments),
+        )
+        llm.add_function_call(message, call)
+        self.function_call_stats["local"] += 1
         self._log(
-            f"Generating {mode.name} mode response for message '{sentence}'",
-            level=logging.INFO,
+            f"Handling '{message}' without LLM: calling '{call.name}'", logging.INFO
         )
+        return call
+
+    async def run_turn(
+        self,
+        result: STTResult,
+        speculation: Speculation | None,
+        previous_turns: list[asyncio.Task[None]],
+    ) -> None:
+        """Responds to a final transcript, after the previous turns are complete."""
+        if previous_turns:
+            await asyncio.wait(previous_turns)
 
+        sentence = result.text
         llm = self.state.current_llm
-        loop = asyncio.get_event_loop()
-        self.current_llm_future = loop.run_in_executor(
-            None,  # default thread pool
-            llm.generate_response,
-            sentence,
-            self.output,
-        )
-        self.current_blacklist = []
+        if speculation is not None and not speculation.matches(
+            llm, result.utterance_id, sentence
+        ):
+            self._log(f"Discarding speculation on '{speculation.message}'")
+            speculation.discard()
+            speculation = None
+
+        local_call = self.match_intent(sentence)
+        if local_call is not None and speculation is not None:
+            speculation.discard()
+            speculation = None
+
+        if local_call is None:
+            mode = self.state.current_mode
+            self._log(
+                f"Generating {mode.name} mode response for message '{sentence}'",
+                level=logging.INFO,
+            )
         try:
-            response = await self.current_llm_future
+            async with asyncio.timeout(settings.LLM_TURN_TIMEOUT):
+                if local_call is not None:
+                    # A failed call is passed to the LLM, like its own calls
+                    call = self.make_local_call(llm, sentence, local_call)
+                    await self.dispatch_function_calls([call])
+                else:
+                    response = await self.generate(llm, sentence, speculation)
+                    await self.dispatch_function_calls(response.function_calls)
+        except TimeoutError:
+            self._log(
+                f"Turn took longer than {settings.LLM_TURN_TIMEOUT}s, giving up",
+                logging.WARNING,
+            )
         except asyncio.CancelledError:
+            if speculation is not None:
+                speculation.discard()
             self._log("Cancelled response because of user input", logging.WARNING)
+            raise
+
+    def _on_turn_done(self, turn: asyncio.Task[None]) -> None:
+        self.turns.discard(turn)
+        if not turn.cancelled() and (e := turn.exception()) is not None:
+            self._log(f"Turn failed: {e!r}", logging.ERROR)
+
+    async def await_sentence(self) -> None:
+        result = await self.sentence_queue.get()
+        sentence = result.text
+
+        # A new utterance starts after the final transcript
+        speculation, self.speculation = self.speculation, None
+        self.partial_text = ""
+        if self.partial_timer is not None:
+            self.partial_timer.cancel()
+            self.partial_timer = None
+
+        if self.is_muted(result):
+            if speculation is not None:
+                speculation.discard()
+            self._log("TTS is brodcasting, skipping input ...", level=logging.INFO)
+            words = set(normalize_transcript(sentence).split())
+            if not (words & self.stopwords).issubset(self.current_blacklist):
+                self.stop_talking()
             return
 
-        self._log(f'LLM responded: "{response.text}"', logging.INFO)
-        self.dispatch_function_calls(response.function_calls)
+        # Turns run in the background, so stopwords are handled while one is running
+        turn = asyncio.create_task(self.run_turn(result, speculation, list(self.turns)))
+        self.turns.add(turn)
+        turn.add_done_callback(self._on_turn_done)
 
     async def await_mixing_event(self) -> None:
         event = await self.mixing_event_queue.get()
@@ -326,14 +543,14 @@ class LLMNode(Node[str | MixingEvent, str]):
 
         match event:
             case MixingEvent.TARGET_WEIGHT_STABLE:
-                self.output("OKAY")
+                self.say("OKAY")
                 self.state.current_llm.add_system_message(
                     "User added expected amount of ingredient. Next step ..."
                 )
                 self.next_recipe_step()
 
             case MixingEvent.TARGET_WEIGHT_SURPASSED:
-                self.output("DU HAST ZU VIEL HINZUGEFÜGT (du bist dumm)")
+                self.say("DU HAST ZU VIEL HINZUGEFÜGT (du bist dumm)")
                 self.state.current_llm.add_system_message(
                     "User added more than expected."
                 )
@@ -346,3 +563,4 @@ class LLMNode(Node[str | MixingEvent, str]):
         async with asyncio.TaskGroup() as tg:
             tg.create_task(continuous_task(self.await_sentence))
             tg.create_task(continuous_task(self.await_mixing_event))
+            tg.create_task(self.prefetcher.loop())
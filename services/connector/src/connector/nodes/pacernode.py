@@ -0,0 +1,126 @@
+import asyncio
+import time
+from typing import Callable
+
+import numpy as np
+
+from ..audio import AudioFrame
+from ..ringbuffer import OverrunPolicy, RingBuffer
+from ..timeline import PlaybackTimeline
+from .base import Node
+
+
+class Pacer(Node[AudioFrame, AudioFrame]):
+    """
+    Jitter buffer that releases (mono) audio at the speaker's real-time rate.
+
+    Incoming audio is buffered and sent on in chunks of **chunk** seconds, keeping at
+    most **lead** seconds ahead of the estimated playback position. Audio that hasn't
+    been released can be discarded instantly with `flush`, so stopping playback only
+    has to wait for the lead, not for everything the source has produced so far.
+
+    If more than **high_water** seconds are buffered, `on_high_water` is called (e.g. to
+    pause reading from the source), and `on_low_water` once it drops below **low_water**.
+    `loop` must run for audio to be released.
+
+    Released audio is queued on **timeline** (a new one if not given), so it tells
+    when audio is actually played, not when it entered the jitter buffer.
+    """
+
+    sample_rate: int
+    lead_ns: int
+    chunk_samples: int
+    high_water: int
+    low_water: int
+    on_high_water: Callable[[], None] | None
+    on_low_water: Callable[[], None] | None
+
+    buffer: RingBuffer
+    data_available: asyncio.Event
+    above_high_water: bool = False
+    timeline: PlaybackTimeline
+
+    def __init__(
+        self,
+        name: str,
+        sample_rate: int,
+        lead: float = 0.15,
+        chunk: float = 0.02,
+        max_buffered: float = 60.0,
+        high_water: float = 20.0,
+        low_water: float = 10.0,
+        on_high_water: Callable[[], None] | None = None,
+        on_low_water: Callable[[], None] | None = None,
+        timeline: PlaybackTimeline | None = None,
+    ) -> None:
+        self.sample_rate = sample_rate
+        self.lead_ns = int(lead * 1e9)
+        self.chunk_samples = max(1, int(chunk * sample_rate))
+        self.high_water = int(high_water * sample_rate)
+        self.low_water = int(low_water * sample_rate)
+        self.on_high_water = on_high_water
+        self.on_low_water = on_low_water
+
+        self.buffer = RingBuffer(
+            int(max_buffered * sample_rate), overrun_policy=OverrunPolicy.DROP_NEWEST
+        )
+        self.data_available = asyncio.Event()
+        self.timeline = timeline or PlaybackTimeline(sample_rate)
+        super().__init__(name)
+
+    @property
+    def buffered(self) -> float:
+        """Seconds of audio that haven't been released yet."""
+        return len(self.buffer) / self.sample_rate
+
+    def handle_input(self, data: AudioFrame) -> None:
+        if data.sample_rate != self.sample_rate:
+            self._log(
+                f"Dropping frame with sample rate {data.sample_rate} (expected {self.sample_rate})"
+            )
+            return
+
+        if self.buffer.write(data.samples) < len(data.samples):
+            self._log(f"Jitter buffer full, dropped audio ({self.buffer.stats()})")
+        self.data_available.set()
+
+        if not self.above_high_water and len(self.buffer) > self.high_water:
+            self.above_high_water = True
+            if self.on_high_water is not None:
+                self.on_high_water()
+
+    def flush(self) -> None:
+        """Discard all audio that hasn't been released yet."""
+        self._log(f"Flushing {self.buffered:.2f}s of audio")
+        self.buffer.clear()
+        self.data_available.clear()
+        self.check_low_water()
+
+    def check_low_water(self) -> None:
+        if self.above_high_water and len(self.buffer) < self.low_water:
+            self.above_high_water = False
+            if self.on_low_water is not None:
+                self.on_low_water()
+
+    def release(self, now_ns: int) -> None:
+        n = min(len(self.buffer), self.chunk_samples)
+        samples = np.empty(n, np.int16)
+        self.buffer.read_into(samples)
+        self.timeline.queue(n, now_ns)
+        self.check_low_water()
+
+        self.output(AudioFrame(samples, self.sample_rate, timestamp_ns=now_ns))
+
+    async def loop(self) -> None:
+        while True:
+            if len(self.buffer) == 0:
+                self.data_available.clear()
+                await self.data_available.wait()
+
+            now_ns = time.monotonic_ns()
+            ahead_ns = self.timeline.end_ns - now_ns  # negative if everything played
+            if ahead_ns > self.lead_ns:
+                await asyncio.sleep((ahead_ns - self.lead_ns) / 1e9)
+                continue
+
+            self.release(now_ns)
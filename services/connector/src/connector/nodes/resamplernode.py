@@ -0,0 +1,42 @@
+from ..audio import AudioFrame
+from ..resample import PolyphaseResampler
+from .base import Node
+
+
+class Resampler(Node[AudioFrame, AudioFrame]):
+    """
+    Converts mono frames of any sample rate to **sample_rate**.
+
+    A streaming resampler is kept per input rate, so the input rate may change
+    (e.g. when switching TTS backends) without reconfiguring the node.
+    Frames that already have the target rate are passed through.
+    """
+
+    sample_rate: int
+    resamplers: dict[int, PolyphaseResampler]
+
+    def __init__(self, name: str, sample_rate: int) -> None:
+        self.sample_rate = sample_rate
+        self.resamplers = {}
+        super().__init__(name)
+
+    def reset(self) -> None:
+        for resampler in self.resamplers.values():
+            resampler.reset()
+
+    def handle_input(self, data: AudioFrame) -> None:
+        if data.sample_rate == self.sample_rate:
+            self.output(data)
+            return
+
+        if (resampler := self.resamplers.get(data.sample_rate)) is None:
+            self._log(f"Resampling {data.sample_rate} Hz to {self.sample_rate} Hz")
+            resampler = self.resamplers[data.sample_rate] = PolyphaseResampler(
+                data.sample_rate, self.sample_rate
+            )
+
+        samples = resampler.process_int16(data.samples)
+        if len(samples) > 0:
+            self.output(
+                AudioFrame(samples, self.sample_rate, data.channels, data.timestamp_ns)
+            )
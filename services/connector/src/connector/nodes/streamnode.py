@@ -1,12 +1,30 @@
 import asyncio
+import bisect
+import json
 import logging
-from datetime import datetime, timedelta
-from typing import Any, Callable
+import time
+from collections import deque
+from typing import Any, Callable, NamedTuple
 
+import numpy as np
 import sounddevice as sd
 
-from connector import config
-
+from ..audio import AudioFrame, FrameDecoder
+from ..config import settings
+from ..framing import MessageDecoder
+from ..phrasecache import PhraseCache
+from ..ringbuffer import OverrunPolicy, RingBuffer
+from ..sttprotocol import RESULT, ResultType, STTResult
+from ..timeline import PlaybackTimeline
+from ..ttsprotocol import (
+    SEQ,
+    ServerMessage,
+    encode_cancel,
+    encode_mark,
+    encode_phrase,
+    encode_prefetch,
+    encode_text,
+)
 from .base import Node
 
 logger = logging.getLogger(__name__)
@@ -15,23 +33,29 @@ logger = logging.getLogger(__name__)
 class BroadcastStream[In, Out](Node[In, Out], asyncio.Protocol):
     own_transport: asyncio.Transport
     on_conn_lost: asyncio.Future[bool]
-    broadcast_end: datetime
 
-    input_converter: Callable[[In], bytes]
-    output_converter: Callable[[bytes], Out]
+    input_converter: Callable[[In], bytes | memoryview]
+    output_converter: Callable[[bytes], Out | None] | None
 
     def __init__(
         self,
         name: str,
         on_conn_lost: asyncio.Future[bool],
-        in_converter: Callable[[In], bytes] = bytes.__call__,
-        out_converter: Callable[[bytes], Out] = lambda x: x,
+        in_converter: Callable[[In], bytes | memoryview] = memoryview,
+        out_converter: Callable[[bytes], Out | None] | None = None,
     ) -> None:
+        """
+        **in_converter** turns input data into something writable to the transport.
+        The default (`memoryview`) passes bytes-like data and `AudioFrame`s without copying.
+
+        **out_converter** turns received bytes into output data. If it returns None,
+        nothing is output (e.g. while waiting for the rest of a partial sample).
+        If no converter is passed, the received bytes are output as they are.
+        """
         self.on_conn_lost = on_conn_lost
         self.data_stopped_callbacks = []
         self.input_converter = in_converter
         self.output_converter = out_converter
-        self.broadcast_end = datetime.now()
 
         super().__init__(name)
 
@@ -47,51 +71,344 @@ class BroadcastStream[In, Out](Node[In, Out], asyncio.Protocol):
 
     def handle_input(self, data: In) -> None:
         out_data = self.input_converter(data)
-        self._log(f"Writing {len(out_data)} bytes to own transport")
+        self._log(f"Writing {memoryview(out_data).nbytes} bytes to own transport")
         self.own_transport.write(out_data)
 
     def data_received(self, data: bytes) -> None:
         self._log(f"Received {len(data)} bytes from own transport")
+        if self.output_converter is None:
+            self.output(data)  # type: ignore (Out is bytes without a converter)
+            return
+
         out_data = self.output_converter(data)
-        self.output(out_data)
+        if out_data is not None:
+            self.output(out_data)
+
 
+class STTStream(BroadcastStream[AudioFrame, STTResult]):
+    """
+    Connection to the STT server (see services/stt/protocol.md).
 
-class TTSStream(BroadcastStream[str, bytes]):
-    stop_flag: bool = False
+    Audio input is sent for transcription, transcription results are output. Their
+    timestamps are mapped from positions in the sent audio to the capture time of
+    that audio, using the last **history** sent frames.
+    """
+
+    messages: MessageDecoder
+    sent_samples: int = 0
+    frame_offsets: deque[int]  # position of each sent frame in the stream
+    frame_timestamps: deque[int]
+    frame_rates: deque[int]
+
+    def __init__(
+        self, name: str, on_conn_lost: asyncio.Future[bool], history: int = 4096
+    ) -> None:
+        self.messages = MessageDecoder()
+        self.frame_offsets = deque(maxlen=history)
+        self.frame_timestamps = deque(maxlen=history)
+        self.frame_rates = deque(maxlen=history)
+        super().__init__(name, on_conn_lost)
+
+    def handle_input(self, data: AudioFrame) -> None:
+        self.frame_offsets.append(self.sent_samples)
+        self.frame_timestamps.append(data.timestamp_ns)
+        self.frame_rates.append(data.sample_rate)
+        self.sent_samples += len(data)
+        super().handle_input(data)
+
+    def sample_time(self, offset: int) -> int:
+        """Capture time (monotonic ns) of the sample at **offset** in the sent stream."""
+        if not self.frame_offsets:
+            return time.monotonic_ns()
+        i = max(0, bisect.bisect_right(self.frame_offsets, offset) - 1)
+        delta = offset - self.frame_offsets[i]
+        return self.frame_timestamps[i] + delta * 1_000_000_000 // self.frame_rates[i]
 
     def data_received(self, data: bytes) -> None:
-        # print(self.is_broadcasting())
-        if not self.is_broadcasting(timedelta(0)):
-            self.broadcast_end = datetime.now()
-        required_time_for_data = timedelta(
-            seconds=(len(data) / 2) / config.SPEAKER_SAMPLE_RATE
+        for msg_type, payload in self.messages.feed(data):
+            utterance_id, start, end = RESULT.unpack_from(payload)
+            result = STTResult(
+                ResultType(msg_type),
+                utterance_id,
+                bytes(payload[RESULT.size :]).decode(errors="replace"),
+                self.sample_time(start),
+                self.sample_time(end),
+            )
+            if result.is_final:
+                latency = (time.monotonic_ns() - result.end_ns) / 1e6
+                self._log(
+                    f"Utterance {utterance_id} transcribed {latency:.0f} ms after it ended",
+                    logging.INFO,
+                )
+            self.output(result)
+
+
+class PendingPhrase(NamedTuple):
+    key: str  # phrase cache key
+    play: bool  # False if only prefetched into the cache
+    done: asyncio.Future[bool]
+
+
+class TTSStream(BroadcastStream[str, AudioFrame]):
+    """
+    Connection to the TTS server (see services/tts/protocol.md).
+
+    Text input is sent for synthesis, synthesized audio is output as frames.
+    `stop` cancels the synthesis on the server; audio that was synthesized before
+    the server acknowledged the cancel is discarded.
+
+    Fixed phrases should be passed to `say` instead. If a **phrase_cache** is
+    given, their audio is cached and played from the cache next time, without
+    a round trip to the server. `prefetch` fills the cache ahead of time. Cached audio
+    mustn't overtake audio that is still being synthesized, so in that case it's
+    deferred until the server answers a MARK sent after the pending text.
+    """
+
+    stop_callbacks: list[Callable[[], None]]
+    timeline: PlaybackTimeline
+
+    messages: MessageDecoder
+    frames: FrameDecoder
+    cancel_seq: int = 0
+    awaiting_cancel_ack: int | None = None
+
+    phrase_cache: PhraseCache | None
+    server_info: dict[str, Any] | None = None  # voice configuration of the server
+    phrase_id: int = 0
+    pending_phrases: dict[int, PendingPhrase]
+    recording: tuple[PendingPhrase, list[bytes]] | None = None
+
+    # Cached audio waiting for the synthesis of the text sent before it
+    mark_id: int = 0
+    deferred: dict[int, bytes]  # by mark id
+    text_pending: bool = False  # text was sent, but may not be synthesized yet
+    text_mark: int | None = None  # answered once the pending text is synthesized
+
+    def __init__(
+        self,
+        name: str,
+        on_conn_lost: asyncio.Future[bool],
+        phrase_cache: PhraseCache | None = None,
+    ) -> None:
+        self.stop_callbacks = []
+        # Updated by the pacer, which knows when audio is played
+        self.timeline = PlaybackTimeline(settings.SPEAKER_SAMPLE_RATE)
+        self.messages = MessageDecoder()
+        self.frames = FrameDecoder(settings.TTS_SPRT)
+        self.phrase_cache = phrase_cache
+        self.pending_phrases = {}
+        self.deferred = {}
+        super().__init__(name, on_conn_lost, in_converter=encode_text)
+
+    @property
+    def is_idle(self) -> bool:
+        """Whether nothing is being synthesized or played right now."""
+        return (
+            not self.pending_phrases
+            and self.recording is None
+            and self.awaiting_cancel_ack is None
+            and not self.deferred
+            and not self.timeline.is_playing()
+        )
+
+    @property
+    def is_synthesizing(self) -> bool:
+        """Whether audio to be played may still arrive from the server."""
+        return (
+            self.text_pending
+            or self.deferred
+            or any(phrase.play for phrase in self.pending_phrases.values())
+            or (self.recording is not None and self.recording[0].play)
         )
-        self.broadcast_end += required_time_for_data
-        # print(
-        #     f"{self.broadcast_end} - {datetime.now()} = {self.broadcast_end - datetime.now()}"
-        # )
 
-        super().data_received(data)
+    def handle_input(self, data: str) -> None:
+        self.text_pending = True
+        self.text_mark = None
+        super().handle_input(data)
 
-    def is_broadcasting(self, delta: timedelta = timedelta(seconds=1)) -> bool:
-        return datetime.now() < self.broadcast_end + delta
+    def say(self, text: str) -> None:
+        """Synthesize a fixed phrase, playing it from the phrase cache if possible."""
+        key = self._phrase_key(text)
+        if key is None:
+            self.handle_input(text)
+            return
 
-    def output(self, data: bytes):
-        if not self.stop_flag:
-            super().output(data)
+        audio = self.phrase_cache.get(key)  # type: ignore (key implies a cache)
+        if audio is not None:
+            if self.is_synthesizing:
+                self.mark_id += 1
+                self.deferred[self.mark_id] = audio
+                if self.text_pending:
+                    self.text_mark = self.mark_id
+                self._log(f"Deferring cached phrase '{text}' (mark={self.mark_id})")
+                self.own_transport.write(encode_mark(self.mark_id))
+                return
 
+            self._log(f"Playing cached phrase '{text}'")
+            self._play_cached(audio)
+            return
 
-class SDStreamNode(Node):
-    stream: sd.RawStream
+        self._send_phrase(text, key, play=True)
 
-    inqueue: asyncio.Queue[int]
-    outqueue: asyncio.Queue[int]
+    def prefetch(self, text: str) -> asyncio.Future[bool]:
+        """
+        Synthesize a fixed phrase into the phrase cache without playing it.
 
-    def __init__(self, name: str, samplerate: int, channels: int = 1) -> None:
-        self.inqueue = asyncio.Queue()
-        self.outqueue = asyncio.Queue()
+        The returned future is True once the phrase is cached and False if it can't
+        be cached (no cache or server info) or the synthesis was cancelled by `stop`.
+        """
+        key = self._phrase_key(text)
+        if key is None:
+            done = asyncio.get_running_loop().create_future()
+            done.set_result(False)
+            return done
+        if self.phrase_cache.contains(key):  # type: ignore (key implies a cache)
+            done = asyncio.get_running_loop().create_future()
+            done.set_result(True)
+            return done
 
-        self.stream = sd.RawStream(
+        return self._send_phrase(text, key, play=False)
+
+    def is_cached(self, text: str) -> bool:
+        key = self._phrase_key(text)
+        return key is not None and self.phrase_cache.contains(key)  # type: ignore
+
+    def _play_cached(self, audio: bytes) -> None:
+        self.output(AudioFrame.from_bytes(audio, self.server_info["sample_rate"]))  # type: ignore
+
+    def _phrase_key(self, text: str) -> str | None:
+        if self.phrase_cache is None or self.server_info is None:
+            return None
+        return PhraseCache.key(
+            text,
+            self.server_info["backend"],
+            self.server_info["voice"],
+            self.server_info["sample_rate"],
+        )
+
+    def _send_phrase(self, text: str, key: str, play: bool) -> asyncio.Future[bool]:
+        self.phrase_id += 1
+        phrase = PendingPhrase(key, play, asyncio.get_running_loop().create_future())
+        self.pending_phrases[self.phrase_id] = phrase
+        self._log(f"Writing phrase '{text}' (id={self.phrase_id}, play={play})")
+        # Prefetches are aborted by the server if anything is sent after them
+        encode = encode_phrase if play else encode_prefetch
+        self.own_transport.write(encode(self.phrase_id, text))
+        return phrase.done
+
+    def stop(self) -> None:
+        """Cancel synthesis and notify the stop callbacks (e.g. to flush buffers)."""
+        self.cancel_seq += 1
+        self.awaiting_cancel_ack = self.cancel_seq
+        self._log(f"Cancelling synthesis (seq={self.cancel_seq})")
+        self.own_transport.write(encode_cancel(self.cancel_seq))
+
+        # Their audio is discarded, so they can't be cached
+        phrases = list(self.pending_phrases.values())
+        if self.recording is not None:
+            phrases.append(self.recording[0])
+        for phrase in phrases:
+            if not phrase.done.done():
+                phrase.done.set_result(False)
+        self.pending_phrases.clear()
+        self.recording = None
+        # Pending text is cancelled, deferred phrases would have played after it
+        self.deferred.clear()
+        self.text_pending = False
+        self.text_mark = None
+
+        for callback in self.stop_callbacks:
+            callback()
+
+    def data_received(self, data: bytes) -> None:
+        for msg_type, payload in self.messages.feed(data):
+            match msg_type:
+                case ServerMessage.AUDIO:
+                    if self.awaiting_cancel_ack is not None:
+                        continue  # synthesized before the cancel
+                    if self.recording is not None:
+                        phrase, chunks = self.recording
+                        chunks.append(bytes(payload))
+                        if not phrase.play:
+                            continue  # prefetched
+                    if (frame := self.frames(payload)) is not None:
+                        self.output(frame)
+
+                case ServerMessage.CANCEL_ACK:
+                    (seq,) = SEQ.unpack(payload)
+                    self._log(f"Synthesis cancelled (seq={seq})")
+                    if seq == self.awaiting_cancel_ack:
+                        self.awaiting_cancel_ack = None
+                        self.frames.remainder = b""
+
+                case ServerMessage.INFO:
+                    self.server_info = json.loads(bytes(payload))
+                    self._log(f"TTS server info: {self.server_info}", logging.INFO)
+                    if self.server_info["sample_rate"] != settings.TTS_SPRT:
+                        self._log(
+                            f"TTS server sample rate {self.server_info['sample_rate']} "
+                            f"doesn't match TTS_SPRT={settings.TTS_SPRT}",
+                            logging.WARNING,
+                        )
+
+                case ServerMessage.PHRASE_START:
+                    (phrase_id,) = SEQ.unpack(payload)
+                    phrase = self.pending_phrases.pop(phrase_id, None)
+                    if phrase is not None:
+                        self.recording = (phrase, [])
+
+                case ServerMessage.PHRASE_END:
+                    if self.recording is not None and self.phrase_cache is not None:
+                        phrase, chunks = self.recording
+                        audio = b"".join(chunks)
+                        self.phrase_cache.put(phrase.key, audio[: len(audio) & ~1])
+                        self._log(f"Phrase cache: {self.phrase_cache.stats()}")
+                        phrase.done.set_result(True)
+                    self.recording = None
+
+                case ServerMessage.PHRASE_ABORTED:
+                    (phrase_id,) = SEQ.unpack(payload)
+                    phrase = self.pending_phrases.pop(phrase_id, None)
+                    if phrase is None and self.recording is not None:
+                        phrase = self.recording[0]  # aborted while synthesizing
+                        self.recording = None
+                    if phrase is not None and not phrase.done.done():
+                        phrase.done.set_result(False)
+
+                case ServerMessage.MARK:
+                    (mark_id,) = SEQ.unpack(payload)
+                    if mark_id == self.text_mark:
+                        self.text_pending = False
+                        self.text_mark = None
+                    audio = self.deferred.pop(mark_id, None)
+                    if audio is not None:
+                        self._log(f"Playing deferred phrase (mark={mark_id})")
+                        self._play_cached(audio)
+
+                case _:
+                    self._log(f"Ignoring unknown message type {msg_type}")
+
+
+class SDStreamNode(Node[AudioFrame, None]):
+    """Plays incoming audio on the local sound device (for debugging)."""
+
+    stream: sd.RawOutputStream
+    ring: RingBuffer
+
+    def __init__(
+        self,
+        name: str,
+        samplerate: int,
+        channels: int = 1,
+        buffer_seconds: float = 1.0,
+    ) -> None:
+        # Filled from the event loop, drained from the PortAudio thread
+        self.ring = RingBuffer(
+            int(samplerate * channels * buffer_seconds),
+            overrun_policy=OverrunPolicy.DROP_OLDEST,
+        )
+
+        self.stream = sd.RawOutputStream(
             samplerate=samplerate,
             channels=channels,
             dtype="int16",
@@ -102,23 +419,12 @@ class SDStreamNode(Node):
 
         super().__init__(name)
 
-    def handle_input(self, data: bytes) -> None:
-        for byte in data:
-            self.outqueue.put_nowait(byte)
+    def handle_input(self, data: AudioFrame) -> None:
+        self.ring.write(data.samples)
 
     def stream_callback(
-        self, indata: bytes, outdata: bytes, frames: int, time: Any, status: Any
+        self, outdata: Any, frames: int, time: Any, status: Any
     ) -> None:
-        try:
-            indata[:] = bytes(  # type: ignore
-                [self.inqueue.get_nowait() for _ in range(len(indata))]
-            )
-        except asyncio.QueueEmpty:
-            logger.debug("Stream inqueue empty")
-
-        try:
-            outdata[:] = bytes(  # type: ignore
-                [self.outqueue.get_nowait() for _ in range(len(outdata))]
-            )
-        except asyncio.QueueEmpty:
-            logger.debug("Stream outqueue empty")
+        out = np.frombuffer(outdata, np.int16)
+        n = self.ring.read_into(out)
+        out[n:] = 0  # play silence on underrun
@@ -0,0 +1,162 @@
+import math
+from collections import deque
+
+import numpy as np
+
+from ..audio import AudioFrame
+from ..dsp import smoothing_coefficient
+from .base import Node
+
+
+class VoiceActivityGate(Node[AudioFrame, AudioFrame]):
+    """
+    Forwards only the (mono) frames that contain speech, plus a little context.
+
+    A frame counts as speech if its level exceeds the tracked noise floor by
+    **margin_db** and its zero crossing rate is below **max_zcr** (voiced speech).
+    Frames more than twice the margin above the noise floor count as speech
+    regardless of their zero crossing rate, so loud fricatives aren't cut off.
+
+    The gate opens once speech has lasted **onset** seconds and sends the last
+    **pre_roll** seconds of audio before the onset first. It closes after **hangover**
+    seconds without speech and then sends **tail_silence** seconds of digital silence,
+    so the STT's endpointer sees the end of the utterance.
+
+    During speech the noise floor keeps rising, but only with the much slower time
+    constant **noise_floor_speech_rise**. Otherwise a step up in background noise
+    (e.g. more AGC gain) would count as speech forever and the gate would never close.
+    """
+
+    margin_db: float
+    max_zcr: float
+    onset: float
+    hangover: float
+    pre_roll: float
+    tail_silence: float
+    noise_floor_rise: float  # time constant for the noise floor to follow rising levels
+    noise_floor_fall: float
+    noise_floor_speech_rise: float
+
+    noise_floor_db: float = -60.0
+    is_open: bool = False
+    speech_time: float = 0.0
+    silence_time: float = 0.0
+    buffered: deque[AudioFrame]
+    buffered_time: float = 0.0
+    silence: np.ndarray
+
+    # Counters
+    frames_forwarded: int = 0
+    frames_suppressed: int = 0
+    segments: int = 0
+
+    def __init__(
+        self,
+        name: str,
+        margin_db: float = 10.0,
+        max_zcr: float = 0.35,
+        onset: float = 0.02,
+        hangover: float = 0.3,
+        pre_roll: float = 0.3,
+        tail_silence: float = 0.8,
+        noise_floor_rise: float = 5.0,
+        noise_floor_fall: float = 0.1,
+        noise_floor_speech_rise: float = 20.0,
+    ) -> None:
+        self.margin_db = margin_db
+        self.max_zcr = max_zcr
+        self.onset = onset
+        self.hangover = hangover
+        self.pre_roll = pre_roll
+        self.tail_silence = tail_silence
+        self.noise_floor_rise = noise_floor_rise
+        self.noise_floor_fall = noise_floor_fall
+        self.noise_floor_speech_rise = noise_floor_speech_rise
+
+        self.buffered = deque()
+        self.silence = np.zeros(0, np.int16)
+        self.silence.flags.writeable = False
+        super().__init__(name)
+
+    def stats(self) -> str:
+        total = self.frames_forwarded + self.frames_suppressed
+        saved = self.frames_suppressed / total if total else 0.0
+        return f"{self.segments} speech segments, {self.frames_forwarded} frames forwarded, {self.frames_suppressed} suppressed ({saved:.0%})"
+
+    def is_speech(self, x: np.ndarray, duration: float) -> bool:
+        n = len(x)
+        samples = x.astype(np.float32)
+        energy = float(np.dot(samples, samples)) / n
+        level_db = 10 * math.log10(energy / 32768.0**2) if energy > 0 else -120.0
+        zcr = np.count_nonzero(np.signbit(x[1:]) != np.signbit(x[:-1])) / (n - 1)
+
+        above_floor = level_db - self.noise_floor_db
+        speech = above_floor > 2 * self.margin_db or (
+            above_floor > self.margin_db and zcr < self.max_zcr
+        )
+
+        if speech:
+            time_constant = self.noise_floor_speech_rise
+        elif level_db > self.noise_floor_db:
+            time_constant = self.noise_floor_rise
+        else:
+            time_constant = self.noise_floor_fall
+        a = smoothing_coefficient(time_constant, duration)
+        self.noise_floor_db = level_db + (self.noise_floor_db - level_db) * a
+
+        return speech
+
+    def handle_input(self, data: AudioFrame) -> None:
+        if len(data.samples) < 2:
+            return
+
+        duration = data.duration
+        if self.is_speech(data.samples, duration):
+            self.speech_time += duration
+            self.silence_time = 0.0
+        else:
+            self.speech_time = 0.0
+            self.silence_time += duration
+
+        if self.is_open:
+            self.frames_forwarded += 1
+            self.output(data)
+
+            if self.silence_time >= self.hangover:
+                self.close(data)
+            return
+
+        self.buffered.append(data)
+        self.buffered_time += duration
+        while (
+            self.buffered_time - self.buffered[0].duration >= self.pre_roll + self.onset
+        ):
+            self.buffered_time -= self.buffered.popleft().duration
+            self.frames_suppressed += 1
+
+        if self.speech_time >= self.onset:
+            self.open()
+
+    def open(self) -> None:
+        self._log("Speech started")
+        self.is_open = True
+        self.segments += 1
+
+        while self.buffered:
+            self.frames_forwarded += 1
+            self.output(self.buffered.popleft())
+        self.buffered_time = 0.0
+
+    def close(self, last_frame: AudioFrame) -> None:
+        self._log(f"Speech ended ({self.stats()})")
+        self.is_open = False
+
+        n = round(self.tail_silence * last_frame.sample_rate) * last_frame.channels
+        if n > len(self.silence):
+            self.silence = np.zeros(n, np.int16)
+            self.silence.flags.writeable = False
+        self.output(
+            AudioFrame(
+                self.silence[:n], last_frame.sample_rate, last_frame.channels
+            ).share()
+        )
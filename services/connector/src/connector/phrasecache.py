@@ -0,0 +1,131 @@
+import hashlib
+import json
+import logging
+import mmap
+import os
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_phrase(text: str) -> str:
+    """Normalize text so that trivially different spellings share a cache entry."""
+    return " ".join(unicodedata.normalize("NFC", text).split()).casefold()
+
+
+@dataclass
+class _Entry:
+    path: Path
+    size: int
+    map: mmap.mmap | None = None
+
+
+class PhraseCache:
+    """
+    Persistent cache of synthesized phrases, stored as raw PCM files in **directory**.
+
+    Entries are memory-mapped on first use, so cached audio isn't copied into memory
+    and is shared with the page cache. If the total size exceeds **max_bytes**, the
+    least recently used entries are deleted. Recency is persisted as the file
+    modification time, so it survives restarts.
+    """
+
+    directory: Path
+    max_bytes: int
+    entries: OrderedDict[str, _Entry]  # least recently used first
+    total_bytes: int = 0
+
+    # Counters
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+    def __init__(self, directory: Path, max_bytes: int) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+
+        directory.mkdir(parents=True, exist_ok=True)
+        paths = sorted(directory.glob("*.pcm"), key=lambda p: p.stat().st_mtime)
+        for path in paths:
+            size = path.stat().st_size
+            self.entries[path.stem] = _Entry(path, size)
+            self.total_bytes += size
+        self._evict()
+
+        logger.info(
+            f"Phrase cache at {directory}: {len(self.entries)} entries, "
+            f"{self.total_bytes / 1e6:.1f}/{max_bytes / 1e6:.1f} MB"
+        )
+
+    @staticmethod
+    def key(text: str, backend: str, voice: str, sample_rate: int) -> str:
+        """Cache key of **text** synthesized with the given TTS configuration."""
+        data = json.dumps([normalize_phrase(text), backend, voice, sample_rate])
+        return hashlib.sha256(data.encode()).hexdigest()
+
+    def contains(self, key: str) -> bool:
+        """Whether **key** is cached, without counting a hit or miss."""
+        return key in self.entries
+
+    def get(self, key: str) -> memoryview | None:
+        """Read-only view on the cached PCM data of **key**, or None on a miss."""
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        if entry.map is None:
+            try:
+                with open(entry.path, "rb") as f:
+                    entry.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Dropping unreadable phrase cache entry {key}: {e}")
+                self._remove(key)
+                self.misses += 1
+                return None
+
+        self.hits += 1
+        self.entries.move_to_end(key)
+        os.utime(entry.path)
+        return memoryview(entry.map)
+
+    def put(self, key: str, data: bytes) -> None:
+        if not data or len(data) > self.max_bytes:
+            return
+        if key in self.entries:
+            self._remove(key)
+
+        path = self.directory / f"{key}.pcm"
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)  # readers never see partial entries
+
+        self.entries[key] = _Entry(path, len(data))
+        self.total_bytes += len(data)
+        self._evict()
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "entries": len(self.entries),
+            "bytes": self.total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def _evict(self) -> None:
+        while self.total_bytes > self.max_bytes:
+            key = next(iter(self.entries))
+            self._remove(key)
+            self.evictions += 1
+
+    def _remove(self, key: str) -> None:
+        # Open maps stay valid after the file is deleted, so frames that still
+        # reference the audio aren't affected
+        entry = self.entries.pop(key)
+        self.total_bytes -= entry.size
+        entry.path.unlink(missing_ok=True)
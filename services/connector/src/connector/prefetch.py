@@ -0,0 +1,76 @@
+import asyncio
+import logging
+
+from .nodes.streamnode import TTSStream
+
+logger = logging.getLogger(__name__)
+
+
+class PhrasePrefetcher:
+    """
+    Synthesizes upcoming fixed phrases (e.g. recipe steps) into the phrase cache.
+
+    Phrases are prefetched in order, at most **lookahead** phrases from the current
+    position. Prefetching only starts while the TTS is idle, so it doesn't delay
+    anything the robot is about to say, and the server aborts a prefetch as soon as
+    anything else is sent. Phrases whose synthesis was cancelled or aborted are
+    prefetched again.
+    """
+
+    tts: TTSStream
+    lookahead: int
+    retry_interval: float
+    phrases: list[str]
+    position: int = 0
+    changed: asyncio.Event
+
+    def __init__(
+        self, tts: TTSStream, lookahead: int = 2, retry_interval: float = 0.5
+    ) -> None:
+        self.tts = tts
+        self.lookahead = lookahead
+        self.retry_interval = retry_interval
+        self.phrases = []
+        self.changed = asyncio.Event()
+
+    def start(self, phrases: list[str], position: int = 0) -> None:
+        self.phrases = phrases
+        self.advance(position)
+
+    def advance(self, position: int) -> None:
+        """Move the look-ahead window to start at **position**."""
+        self.position = position
+        self.changed.set()
+
+    def clear(self) -> None:
+        self.start([])
+
+    def _next_uncached(self) -> str | None:
+        window = self.phrases[self.position : self.position + self.lookahead]
+        for phrase in window:
+            if not self.tts.is_cached(phrase):
+                return phrase
+        return None
+
+    async def loop(self) -> None:
+        if self.tts.phrase_cache is None:
+            return  # nothing to prefetch into
+
+        while True:
+            phrase = self._next_uncached()
+            if phrase is None:
+                self.changed.clear()
+                await self.changed.wait()
+                continue
+
+            if not self.tts.is_idle:
+                if self.tts.timeline.is_playing():
+                    await self.tts.timeline.wait_drained()
+                else:  # waiting for the server
+                    await asyncio.sleep(self.retry_interval)
+                continue
+
+            logger.debug(f"Prefetching phrase '{phrase}'")
+            if not await self.tts.prefetch(phrase):
+                # Cancelled, aborted or not connected yet
+                await asyncio.sleep(self.retry_interval)
@@ -0,0 +1,156 @@
+import json
+import re
+from typing import Any, Callable
+
+from pydantic import BaseModel, ValidationError
+
+from .mixmode_types import (
+    IngredientStep,
+    InstructionStep,
+    StartMixingArguments,
+    StopMixingArguments,
+)
+
+# Spellings of units, casefolded and without trailing dots
+UNIT_ALIASES = {
+    "cl": "cl",
+    "zentiliter": "cl",
+    "centiliter": "cl",
+    "ml": "ml",
+    "milliliter": "ml",
+    "g": "g",
+    "gr": "g",
+    "gramm": "g",
+}
+STEP_TYPES = {
+    "zutat": "zutat",
+    "ingredient": "zutat",
+    "zutat-schritt": "zutat",
+    "anweisung": "anweisung",
+    "instruction": "anweisung",
+    "anweisung-schritt": "anweisung",
+}
+# e.g. "4", "4,5", "1/2" or "4 cl"
+QUANTITY = re.compile(r"(\d+(?:[.,]\d+)?)(?:\s*/\s*(\d+))?\s*([^\d\s].*)?")
+TRAILING_COMMA = re.compile(r",\s*([}\]])")
+CODE_FENCE = re.compile(r"^```(?:json)?\s*|\s*```$")
+
+
+def parse_arguments[T: BaseModel](model: type[T], raw: str) -> tuple[T, list[str]]:
+    """
+    Validates the JSON **raw** arguments of a function call.
+
+    If they're invalid, minor defects (number strings, unit spellings, unknown keys,
+    trailing commas, ...) are repaired before giving up. Returns the arguments and
+    the repairs made; raises the original `ValidationError` if they can't be repaired.
+    """
+    try:
+        return model.model_validate_json(raw), []
+    except ValidationError as error:
+        repairs: list[str] = []
+        try:
+            data = _load_json(raw, repairs)
+            repair = REPAIRS.get(model)
+            if repair is not None:
+                data = repair(data, repairs)
+            if repairs:
+                return model.model_validate(data), repairs
+        except (ValueError, TypeError, LookupError, AttributeError):
+            pass  # incl. ValidationError, the original error is more helpful
+        raise error
+
+
+def _load_json(raw: str, repairs: list[str]) -> Any:
+    try:
+        return json.loads(raw)
+    except json.JSONDecodeError:
+        fixed = TRAILING_COMMA.sub(r"\1", CODE_FENCE.sub("", raw.strip()))
+        data = json.loads(fixed)
+        repairs.append("fixed JSON syntax")
+        return data
+
+
+def _drop_unknown_keys(
+    data: dict[str, Any], model: type[BaseModel], path: str, repairs: list[str]
+) -> None:
+    for key in [key for key in data if key not in model.model_fields]:
+        del data[key]
+        repairs.append(f"removed unknown key '{path}.{key}'")
+
+
+def _repair_quantity(step: dict[str, Any], path: str, repairs: list[str]) -> None:
+    menge = step.get("menge")
+    if not isinstance(menge, str):
+        return
+    if not menge.strip():
+        step["menge"] = None
+        repairs.append(f"{path}.menge: empty string to null")
+        return
+
+    match = QUANTITY.fullmatch(menge.strip())
+    if match is None:
+        return  # not repairable, validation fails
+    number, denominator, unit = match.groups()
+    value = float(number.replace(",", "."))
+    if denominator:
+        value /= int(denominator)
+    step["menge"] = int(value) if value.is_integer() else value
+    repairs.append(f"{path}.menge: '{menge}' to {step['menge']}")
+    if unit and not step.get("einheit"):
+        step["einheit"] = unit.strip()
+        repairs.append(f"{path}.einheit: taken from menge")
+
+
+def _repair_step(step: Any, path: str, repairs: list[str]) -> Any:
+    if not isinstance(step, dict):
+        return step
+
+    typ = step.get("typ")
+    if typ is None:
+        step["typ"] = "zutat" if "name" in step else "anweisung"
+        repairs.append(f"{path}.typ: inferred '{step['typ']}'")
+    elif isinstance(typ, str) and STEP_TYPES.get(typ.strip().casefold(), typ) != typ:
+        step["typ"] = STEP_TYPES[typ.strip().casefold()]
+        repairs.append(f"{path}.typ: '{typ}' to '{step['typ']}'")
+
+    if step["typ"] != "zutat":
+        _drop_unknown_keys(step, InstructionStep, path, repairs)
+        return step
+
+    _repair_quantity(step, path, repairs)
+    einheit = step.get("einheit")
+    if isinstance(einheit, str):
+        unit = UNIT_ALIASES.get(einheit.strip().rstrip(".").casefold(), einheit)
+        if unit != einheit:
+            step["einheit"] = unit
+            repairs.append(f"{path}.einheit: '{einheit}' to '{unit}'")
+    _drop_unknown_keys(step, IngredientStep, path, repairs)
+    return step
+
+
+def repair_start_mixing(data: Any, repairs: list[str]) -> Any:
+    recipe = data["rezept"]
+    if isinstance(recipe, str):  # JSON in a string
+        recipe = data["rezept"] = json.loads(recipe)
+        repairs.append("rezept: parsed JSON string")
+
+    recipe["schritte"] = [
+        _repair_step(step, f"rezept.schritte[{i}]", repairs)
+        for i, step in enumerate(recipe["schritte"])
+    ]
+    return data
+
+
+def repair_stop_mixing(data: Any, repairs: list[str]) -> Any:
+    if "grund" not in data and len(data) == 1:
+        # The only argument under another name (e.g. from an older tool definition)
+        key, value = next(iter(data.items()))
+        repairs.append(f"renamed '{key}' to 'grund'")
+        return {"grund": value}
+    return data
+
+
+REPAIRS: dict[type[BaseModel], Callable[[Any, list[str]], Any]] = {
+    StartMixingArguments: repair_start_mixing,
+    StopMixingArguments: repair_stop_mixing,
+}
@@ -0,0 +1,76 @@
+import math
+from fractions import Fraction
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from .dsp import INT16_MAX, INT16_MIN
+
+
+class PolyphaseResampler:
+    """
+    Streaming sample rate conversion by an arbitrary rational factor up/down.
+
+    Uses a Kaiser-windowed sinc low-pass split into `up` polyphase branches. The last
+    input samples and the fractional output position are carried over between calls,
+    so splitting the input into blocks of any size doesn't change the output.
+    All output samples of a block are computed at once.
+    """
+
+    up: int
+    down: int
+    taps: int  # per phase
+    phases: np.ndarray  # (up, taps), reversed so they line up with input windows
+    history: np.ndarray  # last taps - 1 input samples
+    # Of the next output sample, in 1/up input samples from the block start
+    position: int
+
+    def __init__(
+        self,
+        in_rate: int,
+        out_rate: int,
+        zero_crossings: int = 8,
+        rolloff: float = 0.9,
+        beta: float = 8.0,
+    ) -> None:
+        ratio = Fraction(out_rate, in_rate)
+        self.up, self.down = ratio.numerator, ratio.denominator
+
+        # When decimating, the filter gets narrower, so it needs more taps per phase
+        self.taps = 2 * math.ceil(zero_crossings * max(1.0, self.down / self.up))
+        length = self.taps * self.up
+        cutoff = rolloff * 0.5 / max(self.up, self.down)  # at the upsampled rate
+
+        n = np.arange(length) - (length - 1) / 2
+        h = 2 * cutoff * np.sinc(2 * cutoff * n) * np.kaiser(length, beta) * self.up
+
+        # y[t] = sum_k h[k * up + p] * x[i - k], with i = t * down // up and p = t * down % up
+        self.phases = h.reshape(self.taps, self.up).T[:, ::-1].astype(np.float32).copy()
+        self.history = np.zeros(self.taps - 1, np.float32)
+        self.position = 0
+
+    def reset(self) -> None:
+        self.history[:] = 0
+        self.position = 0
+
+    def process(self, x: np.ndarray) -> np.ndarray:
+        """Resample the next block of the stream. Returns float32 samples."""
+        if len(x) == 0:
+            return np.empty(0, np.float32)
+
+        end = len(x) * self.up
+        count = max(0, -(-(end - self.position) // self.down))
+        positions = self.position + self.down * np.arange(count)
+        self.position += self.down * count - end
+
+        buf = np.concatenate((self.history, x.astype(np.float32, copy=False)))
+        windows = sliding_window_view(buf, self.taps)[positions // self.up]
+        y = np.einsum("ij,ij->i", windows, self.phases[positions % self.up])
+
+        self.history[:] = buf[len(buf) - len(self.history) :]
+        return y
+
+    def process_int16(self, x: np.ndarray) -> np.ndarray:
+        y = self.process(x)
+        np.clip(y, INT16_MIN, INT16_MAX, out=y)
+        return y.astype(np.int16)
@@ -0,0 +1,113 @@
+from enum import Enum
+
+import numpy as np
+from numpy.typing import DTypeLike
+
+
+class OverrunPolicy(Enum):
+    DROP_NEWEST = "drop_newest"
+    DROP_OLDEST = "drop_oldest"
+
+
+class RingBuffer:
+    """
+    Preallocated single-producer/single-consumer ring buffer of samples.
+
+    Positions count samples since creation. The producer only advances `write_pos`,
+    the consumer only advances `read_pos`, and each position is published after the
+    samples have been copied, so one thread may `write` while another one `read_into`s
+    without any locking (e.g. the event loop and a PortAudio callback).
+
+    If a write doesn't fit, the overrun policy decides which samples are lost:
+
+    - DROP_NEWEST: the part of the write that doesn't fit
+    - DROP_OLDEST: the oldest unread samples. The producer can't move `read_pos`,
+      so it asks the consumer to skip ahead via `skip_pos` instead. `skip_pos` is
+      published before the samples are overwritten, so the consumer checks it after
+      copying and copies again if the producer overwrote samples in the meantime.
+    """
+
+    buffer: np.ndarray
+    capacity: int
+    overrun_policy: OverrunPolicy
+
+    write_pos: int = 0
+    read_pos: int = 0
+    skip_pos: int = 0
+
+    # Counters
+    overruns: int = 0
+    underruns: int = 0
+    dropped: int = 0
+
+    def __init__(
+        self,
+        capacity: int,
+        dtype: DTypeLike = np.int16,
+        overrun_policy: OverrunPolicy = OverrunPolicy.DROP_NEWEST,
+    ) -> None:
+        self.buffer = np.zeros(capacity, dtype)
+        self.capacity = capacity
+        self.overrun_policy = overrun_policy
+
+    def __len__(self) -> int:
+        """Number of unread samples."""
+        return self.write_pos - max(self.read_pos, self.skip_pos)
+
+    def stats(self) -> str:
+        return f"{len(self)}/{self.capacity} samples buffered, {self.overruns} overruns ({self.dropped} samples dropped), {self.underruns} underruns"
+
+    def write(self, samples: np.ndarray) -> int:
+        """Append **samples**. Returns the number of samples actually written."""
+        n = len(samples)
+        free = self.capacity - len(self)
+
+        if n > free:
+            self.overruns += 1
+            match self.overrun_policy:
+                case OverrunPolicy.DROP_NEWEST:
+                    self.dropped += n - free
+                    samples = samples[:free]
+                    n = free
+                case OverrunPolicy.DROP_OLDEST:
+                    if n > self.capacity:
+                        self.dropped += n - self.capacity
+                        samples = samples[-self.capacity :]
+                        n = self.capacity
+                    skip_pos = self.write_pos + n - self.capacity
+                    self.dropped += skip_pos - max(self.read_pos, self.skip_pos)
+                    self.skip_pos = skip_pos
+
+        start = self.write_pos % self.capacity
+        first = min(n, self.capacity - start)
+        self.buffer[start : start + first] = samples[:first]
+        self.buffer[: n - first] = samples[first:n]
+
+        self.write_pos += n
+        return n
+
+    def read_into(self, out: np.ndarray) -> int:
+        """
+        Fill **out** with the oldest unread samples.
+        Returns the number of samples read; less than `len(out)` is an underrun.
+        """
+        while True:
+            read_pos = max(self.read_pos, self.skip_pos)
+            n = min(len(out), self.write_pos - read_pos)
+
+            start = read_pos % self.capacity
+            first = min(n, self.capacity - start)
+            out[:first] = self.buffer[start : start + first]
+            out[first:n] = self.buffer[: n - first]
+
+            if self.skip_pos <= read_pos:
+                break  # nothing was overwritten while copying
+
+        self.read_pos = read_pos + n
+        if n < len(out):
+            self.underruns += 1
+        return n
+
+    def clear(self) -> None:
+        """Discard all unread samples. Must be called by the consumer."""
+        self.read_pos = self.write_pos
@@ -0,0 +1,83 @@
+import asyncio
+import re
+from typing import Callable
+
+# Punctuation ending a clause or sentence (plus closing quotes/brackets), followed by
+# whitespace. Requiring the whitespace avoids splitting numbers like "1.5".
+CLAUSE_BOUNDARY = re.compile(r"[.!?…,;:\n]+[\"'»«“”)\]]*\s")
+WHITESPACE = re.compile(r"\s")
+
+
+class ClauseSegmenter:
+    """
+    Coalesces streamed text deltas (e.g. LLM tokens) into clauses for the TTS.
+
+    Text is passed to **emit** up to the last clause boundary, once that is at least
+    **min_length** characters long. If no boundary arrives within **max_delay**
+    seconds, the text is emitted up to the last word boundary anyway, so a slow
+    stream doesn't hold back speech. Must be used from the event loop.
+    """
+
+    emit: Callable[[str], None]
+    min_length: int
+    max_delay: float
+
+    buffer: str = ""
+    timer: asyncio.TimerHandle | None = None
+    closed: bool = False
+
+    def __init__(
+        self,
+        emit: Callable[[str], None],
+        min_length: int = 10,
+        max_delay: float = 0.3,
+    ) -> None:
+        self.emit = emit
+        self.min_length = min_length
+        self.max_delay = max_delay
+
+    def feed(self, delta: str) -> None:
+        if self.closed or not delta:
+            return
+        self.buffer += delta
+
+        end = 0
+        for match in CLAUSE_BOUNDARY.finditer(self.buffer):
+            end = match.end()
+        if end >= self.min_length:
+            self._emit(end)
+
+        if self.buffer and self.timer is None:
+            loop = asyncio.get_running_loop()
+            self.timer = loop.call_later(self.max_delay, self._on_timeout)
+
+    def flush(self) -> None:
+        """Emit all remaining text, e.g. once the stream is complete."""
+        if self.buffer and not self.closed:
+            self._emit(len(self.buffer))
+
+    def close(self) -> None:
+        """Discard remaining and further text, e.g. once the response was cancelled."""
+        self.closed = True
+        self.buffer = ""
+        self._cancel_timer()
+
+    def _on_timeout(self) -> None:
+        self.timer = None
+        end = 0
+        for match in WHITESPACE.finditer(self.buffer):
+            if self.buffer[: match.start()].strip():
+                end = match.end()
+        self._emit(end or len(self.buffer))
+
+    def _emit(self, end: int) -> None:
+        if not self.buffer[:end].strip():
+            return  # keep the whitespace for the next clause
+        text, self.buffer = self.buffer[:end], self.buffer[end:]
+        self._cancel_timer()
+        self.emit(text)
+
+    def _cancel_timer(self) -> None:
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
@@ -0,0 +1,69 @@
+import asyncio
+import string
+from typing import Callable
+
+from .llm import LLM, LLMResponse
+
+
+def normalize_transcript(text: str) -> str:
+    """Normalize a transcript, so hypotheses only differing in case/punctuation match."""
+    words = text.casefold().translate(str.maketrans("", "", string.punctuation)).split()
+    return " ".join(words)
+
+
+class Speculation:
+    """
+    A response generated for a (stable) partial transcript before the final one.
+
+    The streamed text is buffered until the speculation is committed, e.g. once the
+    final transcript turned out to match. Discarding it cancels the request.
+    """
+
+    llm: LLM
+    utterance_id: int
+    message: str
+    history_version: int  # to detect history changes since the response was requested
+    future: asyncio.Future[LLMResponse]
+    discarded: bool = False
+
+    buffer: list[str]
+    sink: Callable[[str], None] | None = None
+
+    def __init__(self, llm: LLM, utterance_id: int, message: str) -> None:
+        self.llm = llm
+        self.utterance_id = utterance_id
+        self.message = message
+        self.history_version = llm.history.version
+        self.buffer = []
+        self.future = asyncio.ensure_future(
+            llm.generate_response(message, self._on_delta, commit=False)
+        )
+
+    def matches(self, llm: LLM, utterance_id: int, transcript: str) -> bool:
+        """Whether the speculative response is valid for a final transcript."""
+        return (
+            llm is self.llm
+            and utterance_id == self.utterance_id
+            and llm.history.version == self.history_version
+            and normalize_transcript(transcript) == normalize_transcript(self.message)
+        )
+
+    def commit(self, sink: Callable[[str], None]) -> None:
+        """Pass the buffered and all further text to **sink**."""
+        self.sink = sink
+        for delta in self.buffer:
+            sink(delta)
+        self.buffer.clear()
+
+    def discard(self) -> None:
+        self.discarded = True
+        self.future.cancel()
+        self.buffer.clear()
+
+    def _on_delta(self, delta: str) -> None:
+        if self.discarded:
+            return
+        if self.sink is None:
+            self.buffer.append(delta)
+        else:
+            self.sink(delta)
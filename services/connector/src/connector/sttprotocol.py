@@ -0,0 +1,25 @@
+"""Messages of the STT server protocol (see services/stt/protocol.md)."""
+
+import struct
+from enum import IntEnum
+from typing import NamedTuple
+
+RESULT = struct.Struct("<IQQ")  # utterance id, start sample, end sample
+
+
+class ResultType(IntEnum):
+    PARTIAL = 1
+    STABLE_PARTIAL = 2
+    FINAL = 3
+
+
+class STTResult(NamedTuple):
+    type: ResultType
+    utterance_id: int
+    text: str
+    start_ns: int  # when the utterance started, on the monotonic clock
+    end_ns: int  # when the (transcribed part of the) utterance ended
+
+    @property
+    def is_final(self) -> bool:
+        return self.type == ResultType.FINAL
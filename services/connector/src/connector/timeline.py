@@ -0,0 +1,78 @@
+import asyncio
+import time
+from collections import deque
+
+
+class PlaybackTimeline:
+    """
+    Tracks when queued audio will have been played, on the monotonic clock.
+
+    Audio is assumed to play back-to-back at **sample_rate** from the moment it is
+    queued. If the timeline has run dry, newly queued audio starts a new run at the
+    current time. All positions are derived from sample counts, so they don't drift.
+    The last **history** runs are kept to answer `was_playing`.
+    """
+
+    sample_rate: int
+    started_ns: int = 0  # start of the current run
+    queued: int = 0  # samples queued in the current run
+    played_before: int = 0  # samples played in earlier runs
+    runs: deque[tuple[int, int]]  # (start_ns, end_ns) of earlier runs
+
+    def __init__(self, sample_rate: int, history: int = 32) -> None:
+        self.sample_rate = sample_rate
+        self.runs = deque(maxlen=history)
+
+    @property
+    def end_ns(self) -> int:
+        """When the queued audio will have been played."""
+        return self.started_ns + self.queued * 1_000_000_000 // self.sample_rate
+
+    def queue(self, samples: int, now_ns: int | None = None) -> None:
+        now_ns = time.monotonic_ns() if now_ns is None else now_ns
+        if self.end_ns <= now_ns:
+            self._start_run(now_ns)
+        self.queued += samples
+
+    def flush(self, keep: float = 0.0, now_ns: int | None = None) -> None:
+        """Drop queued audio, except for the next **keep** seconds (e.g. already sent)."""
+        now_ns = time.monotonic_ns() if now_ns is None else now_ns
+        keep_until_ns = now_ns + int(keep * 1e9)
+        if self.end_ns > keep_until_ns:
+            elapsed_ns = keep_until_ns - self.started_ns
+            self.queued = elapsed_ns * self.sample_rate // 1_000_000_000
+
+    def remaining(self, now_ns: int | None = None) -> float:
+        """Seconds until all queued audio has been played."""
+        now_ns = time.monotonic_ns() if now_ns is None else now_ns
+        return max(0, self.end_ns - now_ns) / 1e9
+
+    def playhead(self, now_ns: int | None = None) -> int:
+        """Number of samples played in total."""
+        now_ns = time.monotonic_ns() if now_ns is None else now_ns
+        elapsed = max(0, now_ns - self.started_ns) * self.sample_rate // 1_000_000_000
+        return self.played_before + min(self.queued, elapsed)
+
+    def is_playing(self, within: float = 0.0, now_ns: int | None = None) -> bool:
+        """Whether audio is playing now or stopped less than **within** seconds ago."""
+        now_ns = time.monotonic_ns() if now_ns is None else now_ns
+        return now_ns < self.end_ns + int(within * 1e9)
+
+    def was_playing(self, start_ns: int, end_ns: int) -> bool:
+        """Whether any audio played between **start_ns** and **end_ns**."""
+        runs = [*self.runs, (self.started_ns, self.end_ns)]
+        return any(
+            run_start < end_ns and start_ns < run_end for run_start, run_end in runs
+        )
+
+    async def wait_drained(self) -> None:
+        """Wait until all queued audio (including audio queued meanwhile) has played."""
+        while (remaining := self.remaining()) > 0:
+            await asyncio.sleep(remaining)
+
+    def _start_run(self, now_ns: int) -> None:
+        if self.queued > 0:
+            self.runs.append((self.started_ns, self.end_ns))
+        self.played_before += self.queued
+        self.started_ns = now_ns
+        self.queued = 0
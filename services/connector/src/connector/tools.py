@@ -0,0 +1,81 @@
+from typing import Any
+
+from pydantic import BaseModel
+
+from .mixmode_types import (
+    NextRecipeStepArguments,
+    StartMixingArguments,
+    StopMixingArguments,
+)
+
+# Keywords strict mode doesn't support (pydantic still validates them)
+UNSUPPORTED_KEYWORDS = {
+    "title",
+    "default",
+    "minLength",
+    "maxLength",
+    "minItems",
+    "maxItems",
+    "discriminator",
+}
+
+
+def strict_schema(model: type[BaseModel]) -> dict[str, Any]:
+    """
+    JSON schema of **model** in the subset supported by OpenAI's strict mode.
+
+    References are inlined, every object forbids additional properties and requires
+    all of its properties (optional ones are nullable instead).
+    """
+    schema = model.model_json_schema()
+    defs = schema.pop("$defs", {})
+
+    def convert(node: Any) -> Any:
+        if isinstance(node, list):
+            return [convert(item) for item in node]
+        if not isinstance(node, dict):
+            return node
+
+        if "$ref" in node:
+            siblings = {k: v for k, v in node.items() if k != "$ref"}
+            node = {**defs[node["$ref"].removeprefix("#/$defs/")], **siblings}
+
+        result = {}
+        for key, value in node.items():
+            if key in UNSUPPORTED_KEYWORDS:
+                continue
+            if key == "const":
+                result["enum"] = [value]
+            elif key == "oneOf":
+                result["anyOf"] = convert(value)
+            elif key == "properties":
+                result[key] = {name: convert(prop) for name, prop in value.items()}
+            else:
+                result[key] = convert(value)
+
+        if result.get("type") == "object":
+            result["additionalProperties"] = False
+            result["required"] = list(result.get("properties", {}))
+        return result
+
+    return convert(schema)
+
+
+def function_tool(name: str, arguments: type[BaseModel]) -> dict[str, Any]:
+    """Strict function tool, described by the docstring of its **arguments** model."""
+    parameters = strict_schema(arguments)
+    parameters.pop("description", None)
+    return {
+        "type": "function",
+        "name": name,
+        "description": " ".join((arguments.__doc__ or "").split()),
+        "parameters": parameters,
+        "strict": True,
+    }
+
+
+RECIPE_SEARCH_TOOLS = [function_tool("start_mixing_mode", StartMixingArguments)]
+MIXING_TOOLS = [
+    function_tool("stop_mixing_mode", StopMixingArguments),
+    function_tool("next_recipe_step", NextRecipeStepArguments),
+]
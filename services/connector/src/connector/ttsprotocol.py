@@ -0,0 +1,46 @@
+"""Messages of the TTS server protocol (see services/tts/protocol.md)."""
+
+import struct
+from enum import IntEnum
+
+from .framing import encode_message
+
+SEQ = struct.Struct("<I")
+
+
+class ClientMessage(IntEnum):
+    TEXT = 1
+    CANCEL = 2
+    PHRASE = 3
+    MARK = 4
+    PREFETCH = 5
+
+
+class ServerMessage(IntEnum):
+    AUDIO = 1
+    CANCEL_ACK = 2
+    INFO = 3
+    PHRASE_START = 4
+    PHRASE_END = 5
+    MARK = 6
+    PHRASE_ABORTED = 7
+
+
+def encode_text(text: str) -> bytes:
+    return encode_message(ClientMessage.TEXT, text.encode())
+
+
+def encode_cancel(seq: int) -> bytes:
+    return encode_message(ClientMessage.CANCEL, SEQ.pack(seq))
+
+
+def encode_phrase(phrase_id: int, text: str) -> bytes:
+    return encode_message(ClientMessage.PHRASE, SEQ.pack(phrase_id) + text.encode())
+
+
+def encode_prefetch(phrase_id: int, text: str) -> bytes:
+    return encode_message(ClientMessage.PREFETCH, SEQ.pack(phrase_id) + text.encode())
+
+
+def encode_mark(mark_id: int) -> bytes:
+    return encode_message(ClientMessage.MARK, SEQ.pack(mark_id))
@@ -0,0 +1,172 @@
+import asyncio
+import logging
+import time
+
+import numpy as np
+from faster_whisper import WhisperModel
+from faster_whisper.audio import pad_or_trim
+from faster_whisper.tokenizer import Tokenizer
+
+SAMPLE_RATE = 16000
+MAX_SEGMENT_LEN = 30.0  # Whisper's input window in seconds
+
+logger = logging.getLogger(__name__)
+
+
+class BatchedWhisper:
+    """
+    Whisper model that transcribes several utterances in one batched inference.
+
+    Utterances longer than Whisper's 30 s window are transcribed on their own.
+    """
+
+    model: WhisperModel
+    tokenizer: Tokenizer
+    prompt: list[int]
+    beam_size: int
+
+    def __init__(
+        self,
+        model: str,
+        device: str,
+        compute_type: str = "default",
+        language: str = "de",
+        beam_size: int = 5,
+        cpu_threads: int = 0,
+    ) -> None:
+        self.model = WhisperModel(
+            model, device=device, compute_type=compute_type, cpu_threads=cpu_threads
+        )
+        self.tokenizer = Tokenizer(
+            self.model.hf_tokenizer,
+            self.model.model.is_multilingual,
+            task="transcribe",
+            language=language,
+        )
+        self.prompt = self.model.get_prompt(
+            self.tokenizer, previous_tokens=[], without_timestamps=True
+        )
+        self.beam_size = beam_size
+
+    def transcribe_batch(self, utterances: list[np.ndarray]) -> list[str]:
+        """Transcribe float32 16 kHz utterances, returning one text per utterance."""
+        texts = [""] * len(utterances)
+
+        batch = []
+        for i, audio in enumerate(utterances):
+            if len(audio) > MAX_SEGMENT_LEN * SAMPLE_RATE:
+                segments, _ = self.model.transcribe(
+                    audio,
+                    language=self.tokenizer.language_code,
+                    beam_size=self.beam_size,
+                )
+                texts[i] = " ".join(segment.text for segment in segments)
+            else:
+                batch.append(i)
+
+        if batch:
+            features = np.stack(
+                [
+                    pad_or_trim(self.model.feature_extractor(utterances[i]))
+                    for i in batch
+                ]
+            )
+            encoder_output = self.model.encode(features)
+            results = self.model.model.generate(
+                encoder_output,
+                [self.prompt] * len(batch),
+                beam_size=self.beam_size,
+                max_length=self.model.max_length,
+                suppress_blank=True,
+                suppress_tokens=[-1],
+            )
+            for i, result in zip(batch, results):
+                tokens = [
+                    token
+                    for token in result.sequences_ids[0]
+                    if token < self.tokenizer.eot
+                ]
+                texts[i] = self.tokenizer.decode(tokens)
+
+        return texts
+
+
+class BatchScheduler:
+    """
+    Collects utterances of all sessions and transcribes them in batches.
+
+    A batch is started once **max_batch_size** utterances are waiting, or
+    **max_wait** seconds after the first one arrived. Utterances arriving while a
+    batch is transcribed are collected for the next one.
+    """
+
+    model: BatchedWhisper
+    max_batch_size: int
+    max_wait: float
+
+    pending: list[tuple[np.ndarray, asyncio.Future[str]]]
+    arrived: asyncio.Event
+    full: asyncio.Event
+
+    # Counters
+    batches: int = 0
+    utterances: int = 0
+
+    def __init__(
+        self, model: BatchedWhisper, max_batch_size: int = 4, max_wait: float = 0.05
+    ) -> None:
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.pending = []
+        self.arrived = asyncio.Event()
+        self.full = asyncio.Event()
+
+    async def transcribe(self, audio: np.ndarray) -> str:
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((audio, future))
+        self.arrived.set()
+        if len(self.pending) >= self.max_batch_size:
+            self.full.set()
+        return await future
+
+    async def run(self) -> None:
+        while True:
+            await self.arrived.wait()
+            if len(self.pending) < self.max_batch_size:
+                try:
+                    await asyncio.wait_for(self.full.wait(), self.max_wait)
+                except TimeoutError:
+                    pass
+
+            batch = self.pending[: self.max_batch_size]
+            self.pending = self.pending[self.max_batch_size :]
+            if len(self.pending) < self.max_batch_size:
+                self.full.clear()
+            if not self.pending:
+                self.arrived.clear()
+
+            start = time.perf_counter()
+            try:
+                texts = await asyncio.to_thread(
+                    self.model.transcribe_batch, [audio for audio, _ in batch]
+                )
+            except Exception as e:
+                logger.error("Batch transcription failed: %s", e, exc_info=True)
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.utterances += len(batch)
+            logger.info(
+                "Transcribed batch of %d in %.2fs (%d utterances in %d batches)",
+                len(batch),
+                time.perf_counter() - start,
+                self.utterances,
+                self.batches,
+            )
+            for (_, future), text in zip(batch, texts):
+                if not future.done():
+                    future.set_result(text)
@@ -0,0 +1,255 @@
+"""
+Benchmarks recorder configurations on recorded utterances, see README.md.
+
+Every configuration of the grid is run in a fresh process, so its peak memory can be
+measured. Utterances are fed in real time, like the server receives them.
+"""
+
+import argparse
+import csv
+import itertools
+import logging
+import re
+import resource
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+from threading import Thread
+from typing import NamedTuple
+
+import numpy as np
+import soundfile as sf
+from RealtimeSTT import AudioToTextRecorder
+
+from recorder import RecorderConfig, create_recorder, env_use_cuda, reset_recorder
+
+SAMPLE_RATE = 16000
+CHUNK_LEN = 0.05  # seconds of audio fed at once
+TRAILING_SILENCE = 2.0  # seconds, so the recorder detects the end of the utterance
+
+
+class Utterance(NamedTuple):
+    name: str
+    audio: np.ndarray  # int16, 16 kHz mono
+    reference: str | None  # transcript from `<name>.txt`
+
+    @property
+    def duration(self) -> float:
+        return len(self.audio) / SAMPLE_RATE
+
+
+class UtteranceResult(NamedTuple):
+    name: str
+    duration: float
+    text: str
+    latency: float  # from the end of the audio until the transcript is ready
+    transcription_time: float
+    wer: float | None
+
+    @property
+    def rtf(self) -> float:
+        return self.transcription_time / self.duration
+
+
+def load_utterances(directory: Path) -> list[Utterance]:
+    utterances = []
+    for path in sorted(directory.glob("*.wav")):
+        audio, sample_rate = sf.read(path, dtype="int16", always_2d=True)
+        audio = audio[:, 0]
+        if sample_rate != SAMPLE_RATE:
+            # Linear interpolation is good enough for a benchmark
+            n = int(len(audio) * SAMPLE_RATE / sample_rate)
+            audio = np.interp(
+                np.linspace(0, len(audio), n, endpoint=False),
+                np.arange(len(audio)),
+                audio,
+            ).astype(np.int16)
+
+        reference_path = path.with_suffix(".txt")
+        reference = (
+            reference_path.read_text(encoding="utf-8").strip()
+            if reference_path.exists()
+            else None
+        )
+        utterances.append(Utterance(path.stem, audio, reference))
+    return utterances
+
+
+def normalize_words(text: str) -> list[str]:
+    return re.sub(r"[^\w\s]", " ", text.casefold()).split()
+
+
+def word_error_rate(reference: str, hypothesis: str) -> float:
+    """Word-level edit distance divided by the number of reference words."""
+    ref, hyp = normalize_words(reference), normalize_words(hypothesis)
+    if not ref:
+        return float(bool(hyp))
+
+    distances = list(range(len(hyp) + 1))
+    for i, ref_word in enumerate(ref, 1):
+        previous, distances[0] = distances[0], i
+        for j, hyp_word in enumerate(hyp, 1):
+            previous, distances[j] = (
+                distances[j],
+                min(
+                    distances[j] + 1,  # deletion
+                    distances[j - 1] + 1,  # insertion
+                    previous + (ref_word != hyp_word),  # substitution
+                ),
+            )
+    return distances[-1] / len(ref)
+
+
+def transcribe_utterance(
+    stt: AudioToTextRecorder, utterance: Utterance
+) -> UtteranceResult:
+    speech_end = 0.0
+    chunk_samples = int(CHUNK_LEN * SAMPLE_RATE)
+    silence = np.zeros(int(TRAILING_SILENCE * SAMPLE_RATE), np.int16)
+
+    def feed() -> None:
+        nonlocal speech_end
+        start = time.perf_counter()
+        audio = np.concatenate([utterance.audio, silence])
+        for i, offset in enumerate(range(0, len(audio), chunk_samples)):
+            stt.feed_audio(audio[offset : offset + chunk_samples].tobytes())
+            if offset + chunk_samples >= len(utterance.audio) and not speech_end:
+                speech_end = time.perf_counter()
+            time.sleep(max(0.0, start + (i + 1) * CHUNK_LEN - time.perf_counter()))
+        stt.interrupt_stop_event.set()  # no more speech
+
+    feeder = Thread(target=feed, daemon=True)
+    feeder.start()
+
+    # Like the server, but the utterance may be split by the VAD
+    texts = []
+    done = transcription_time = 0.0
+    while True:
+        stt.wait_audio()
+        if stt.interrupt_stop_event.is_set() or stt.audio is None or not len(stt.audio):
+            break
+        start = time.perf_counter()
+        texts.append(stt.transcribe())
+        done = time.perf_counter()
+        transcription_time += done - start
+    feeder.join()
+    reset_recorder(stt)
+
+    text = " ".join(t for t in texts if t)
+    return UtteranceResult(
+        utterance.name,
+        utterance.duration,
+        text,
+        max(0.0, done - speech_end) if texts else float("nan"),
+        transcription_time,
+        word_error_rate(utterance.reference, text)
+        if utterance.reference is not None
+        else None,
+    )
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in KiB on Linux (the recorder's workers are threads there)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_config(
+    config: RecorderConfig, utterances: list[Utterance]
+) -> tuple[list[UtteranceResult], float, float]:
+    """Returns the utterance results, load time and peak RSS in MiB."""
+    start = time.perf_counter()
+    stt = create_recorder(config)
+    load_time = time.perf_counter() - start
+    try:
+        results = [transcribe_utterance(stt, utterance) for utterance in utterances]
+    finally:
+        stt.shutdown()
+    return results, load_time, peak_rss_mb()
+
+
+def summarize(
+    config: RecorderConfig,
+    results: list[UtteranceResult],
+    load_time: float,
+    peak_rss: float,
+) -> dict[str, object]:
+    latencies = [r.latency for r in results if r.latency == r.latency]  # not NaN
+    wers = [r.wer for r in results if r.wer is not None]
+    return {
+        **config._asdict(),
+        "utterances": len(results),
+        "load_s": round(load_time, 1),
+        "latency_mean_s": round(statistics.mean(latencies), 3) if latencies else None,
+        "latency_max_s": round(max(latencies), 3) if latencies else None,
+        "rtf": round(
+            sum(r.transcription_time for r in results)
+            / sum(r.duration for r in results),
+            3,
+        ),
+        "peak_rss_mb": round(peak_rss),
+        "wer": round(statistics.mean(wers), 3) if wers else None,
+    }
+
+
+def main() -> None:
+    default = RecorderConfig.from_env()
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "directory",
+        type=Path,
+        help="recorded utterances (*.wav), with optional reference transcripts (*.txt)",
+    )
+    parser.add_argument("--models", nargs="+", default=[default.model])
+    parser.add_argument("--compute-types", nargs="+", default=[default.compute_type])
+    parser.add_argument("--threads", nargs="+", type=int, default=[default.cpu_threads])
+    parser.add_argument("--beam-size", type=int, default=default.beam_size)
+    parser.add_argument("--output", type=Path, help="write the summary as CSV")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    utterances = load_utterances(args.directory)
+    if not utterances:
+        parser.error(f"No *.wav files in {args.directory}")
+    print(
+        f"{len(utterances)} utterances, "
+        f"{sum(u.duration for u in utterances):.1f}s of audio"
+    )
+
+    device = "cuda" if env_use_cuda() else "cpu"
+    summaries = []
+    for model, compute_type, threads in itertools.product(
+        args.models, args.compute_types, args.threads
+    ):
+        config = RecorderConfig(model, device, compute_type, args.beam_size, threads)
+        print(f"\n{config}")
+        with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as executor:
+            try:
+                results, load_time, peak_rss = executor.submit(
+                    run_config, config, utterances
+                ).result()
+            except Exception as e:
+                print(f"  failed: {e}")
+                continue
+
+        for r in results:
+            wer = f"{r.wer:.2f}" if r.wer is not None else "-"
+            print(
+                f"  {r.name}: {r.duration:.1f}s, latency {r.latency:.2f}s, "
+                f"RTF {r.rtf:.2f}, WER {wer}: {r.text}"
+            )
+        summary = summarize(config, results, load_time, peak_rss)
+        print(f"  {summary}")
+        summaries.append(summary)
+
+    if args.output and summaries:
+        with open(args.output, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(summaries[0]))
+            writer.writeheader()
+            writer.writerows(summaries)
+        print(f"\nWrote summary to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
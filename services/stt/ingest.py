@@ -0,0 +1,217 @@
+import logging
+import os
+import queue
+import time
+from datetime import datetime
+from enum import Enum
+from threading import Lock, Thread
+from typing import Callable
+
+import numpy as np
+import soundfile as sf
+
+logger = logging.getLogger(__name__)
+
+
+class OverflowPolicy(Enum):
+    DROP_OLDEST = "drop_oldest"
+    DROP_NEWEST = "drop_newest"
+    BACKPRESSURE = "backpressure"  # stop reading from the socket until there's room
+
+
+class RotatingWavWriter:
+    """
+    Streams 16 bit PCM to WAV files in **directory**, starting a new file once the
+    current one is **max_seconds** long or **max_bytes** large.
+    """
+
+    directory: str
+    prefix: str
+    sample_rate: int
+    max_samples: int
+    file: sf.SoundFile | None = None
+    file_samples: int = 0
+    files: int = 0  # numbers the files, rotation may be quicker than their timestamps
+    remainder: bytes = b""  # odd byte of the last chunk, a sample may span chunks
+
+    def __init__(
+        self,
+        directory: str,
+        prefix: str,
+        sample_rate: int,
+        max_seconds: float = 600.0,
+        max_bytes: int = 64 * 1024 * 1024,
+    ) -> None:
+        self.directory = directory
+        self.prefix = prefix
+        self.sample_rate = sample_rate
+        self.max_samples = min(int(max_seconds * sample_rate), max_bytes // 2)
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, data: bytes) -> None:
+        if self.remainder:
+            data = self.remainder + data
+        whole = len(data) & ~1
+        self.remainder = data[whole:]
+        samples = np.frombuffer(data, np.int16, whole // 2)
+        while len(samples):
+            if self.file is None or self.file_samples >= self.max_samples:
+                self._rotate()
+            assert self.file is not None
+            n = min(len(samples), self.max_samples - self.file_samples)
+            self.file.write(samples[:n])
+            self.file_samples += n
+            samples = samples[n:]
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.file.close()
+            logger.info("Saved debug audio to %s", self.file.name)
+            self.file = None
+
+    def _rotate(self) -> None:
+        self.close()
+        filename = os.path.join(
+            self.directory,
+            f"{self.prefix}_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}_{self.files}.wav",
+        )
+        self.file = sf.SoundFile(
+            filename, "w", self.sample_rate, 1, "PCM_16", format="WAV"
+        )
+        self.file_samples = 0
+        self.files += 1
+
+
+class AudioIngestor:
+    """
+    Passes received audio to **feed** (e.g. a recorder's `feed_audio`) from a
+    separate thread, so slow processing can't stall the event loop.
+
+    At most **max_samples** samples are queued. If more arrive, the **policy**
+    decides what happens: the oldest or newest audio is dropped, or
+    **pause_reading** is called until the queue has drained to half its size
+    (`resume_reading` is called from the ingest thread).
+
+    Each chunk carries its end position in the received stream, so positions of
+    later audio stay correct when chunks are dropped. Only whole samples are queued;
+    a trailing odd byte is held back until the next chunk.
+    """
+
+    feed: Callable[[bytes], None]
+    max_samples: int
+    policy: OverflowPolicy
+    pause_reading: Callable[[], None] | None
+    resume_reading: Callable[[], None] | None
+    wav_writer: RotatingWavWriter | None
+
+    chunks: queue.Queue[tuple[int, float, bytes] | None]
+    thread: Thread
+    lock: Lock  # guards `queued_samples`, which both threads update
+    queued_samples: int = 0
+    received_samples: int = 0  # stream position of the last received chunk
+    remainder: bytes = b""  # odd byte of the last chunk, a sample may span chunks
+    fed_samples: int = 0  # stream position of the last fed chunk
+    paused: bool = False
+
+    # Metrics
+    dropped_samples: int = 0
+    lag: float = 0.0  # time the last chunk was queued, in seconds
+    max_lag: float = 0.0
+
+    def __init__(
+        self,
+        feed: Callable[[bytes], None],
+        max_samples: int,
+        policy: OverflowPolicy = OverflowPolicy.DROP_OLDEST,
+        pause_reading: Callable[[], None] | None = None,
+        resume_reading: Callable[[], None] | None = None,
+        wav_writer: RotatingWavWriter | None = None,
+    ) -> None:
+        self.feed = feed
+        self.max_samples = max_samples
+        self.policy = policy
+        self.pause_reading = pause_reading
+        self.resume_reading = resume_reading
+        self.wav_writer = wav_writer
+        self.chunks = queue.Queue()
+        self.lock = Lock()
+        self.thread = Thread(target=self._run, name="ingest", daemon=True)
+        self.thread.start()
+
+    def put(self, data: bytes) -> None:
+        if self.remainder:
+            data = self.remainder + data
+        whole = len(data) & ~1
+        data, self.remainder = data[:whole], data[whole:]
+        if not data:
+            return
+
+        samples = len(data) // 2
+        self.received_samples += samples
+
+        while self.queued_samples + samples > self.max_samples:
+            match self.policy:
+                case OverflowPolicy.DROP_NEWEST:
+                    self._count_drop(samples)
+                    return
+                case OverflowPolicy.DROP_OLDEST:
+                    try:
+                        item = self.chunks.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is None:  # closing
+                        self.chunks.put_nowait(None)
+                        return
+                    self._dequeued(len(item[2]) // 2)
+                    self._count_drop(len(item[2]) // 2)
+                case OverflowPolicy.BACKPRESSURE:
+                    # Reading stops after this chunk, which is still queued
+                    if not self.paused and self.pause_reading is not None:
+                        self.paused = True
+                        self.pause_reading()
+                    break
+
+        with self.lock:
+            self.queued_samples += samples
+        self.chunks.put_nowait((self.received_samples, time.monotonic(), data))
+
+    def close(self) -> None:
+        """Stop the ingest thread once all queued audio has been fed."""
+        self.chunks.put_nowait(None)
+        self.thread.join()
+        if self.wav_writer is not None:
+            self.wav_writer.close()
+
+    def stats(self) -> dict[str, float]:
+        return {
+            "queued_samples": self.queued_samples,
+            "dropped_samples": self.dropped_samples,
+            "lag": round(self.lag, 3),
+            "max_lag": round(self.max_lag, 3),
+        }
+
+    def _count_drop(self, samples: int) -> None:
+        if self.dropped_samples == 0:
+            logger.warning("Ingest queue full, dropping audio (%s)", self.policy.value)
+        self.dropped_samples += samples
+
+    def _dequeued(self, samples: int) -> None:
+        with self.lock:
+            self.queued_samples -= samples
+
+    def _run(self) -> None:
+        while (item := self.chunks.get()) is not None:
+            position, queued_at, data = item
+            self.lag = time.monotonic() - queued_at
+            self.max_lag = max(self.max_lag, self.lag)
+
+            self.feed(data)
+            self.fed_samples = position
+            if self.wav_writer is not None:
+                self.wav_writer.write(data)
+
+            self._dequeued(len(data) // 2)
+            if self.paused and self.queued_samples <= self.max_samples // 2:
+                self.paused = False
+                if self.resume_reading is not None:
+                    self.resume_reading()
@@ -0,0 +1,72 @@
+import os
+from typing import NamedTuple
+
+import torch
+from RealtimeSTT import AudioToTextRecorder
+
+
+def env_use_cuda() -> bool:
+    return os.getenv("USE_CUDA", "false").lower() in ("1", "true", "yes")
+
+
+class RecorderConfig(NamedTuple):
+    model: str
+    device: str
+    compute_type: str = "default"  # e.g. int8, float16, float32
+    beam_size: int = 5
+    cpu_threads: int = 0  # 0 keeps the libraries' defaults
+
+    @classmethod
+    def from_env(cls) -> "RecorderConfig":
+        use_cuda = env_use_cuda()
+        return cls(
+            model=os.getenv("STT_MODEL", "large-v2" if use_cuda else "small"),
+            device="cuda" if use_cuda else "cpu",
+            compute_type=os.getenv("STT_COMPUTE_TYPE", "default"),
+            beam_size=int(os.getenv("STT_BEAM_SIZE", "5")),
+            cpu_threads=int(os.getenv("STT_CPU_THREADS", "0")),
+        )
+
+
+def create_recorder(config: RecorderConfig) -> AudioToTextRecorder:
+    if config.cpu_threads:
+        # Whisper (CTranslate2) reads this when its model is loaded, the VAD uses torch
+        os.environ["OMP_NUM_THREADS"] = str(config.cpu_threads)
+        torch.set_num_threads(config.cpu_threads)
+
+    return AudioToTextRecorder(
+        use_microphone=False,
+        model=config.model,
+        device=config.device,
+        compute_type=config.compute_type,
+        beam_size=config.beam_size,
+        spinner=False,
+        ensure_sentence_ends_with_period=True,
+        language="de",
+        print_transcription_time=True,
+        enable_realtime_transcription=True,
+        use_main_model_for_realtime=True,
+        silero_sensitivity=0.9,
+        silero_deactivity_detection=False,
+        no_log_file=True,
+    )
+
+
+def reset_recorder(stt: AudioToTextRecorder) -> None:
+    """Drop all audio and recording state of a session, so the recorder can be reused."""
+    # RealtimeSTT has no public reset; this mirrors what `abort` and `stop` do
+    # without waiting for a `text` call that will never come
+    stt.start_recording_on_voice_activity = False
+    stt.stop_recording_on_voice_deactivity = False
+    if stt.is_recording:
+        stt.is_recording = False
+        stt.start_recording_event.clear()
+        stt.stop_recording_event.set()
+    stt.frames.clear()
+    stt.buffer = bytearray()  # partial chunk of `feed_audio`
+    stt.clear_audio_queue()
+    stt.interrupt_stop_event.clear()
+    stt.was_interrupted.clear()
+    stt.on_recording_start = None
+    stt.on_realtime_transcription_update = None
+    stt.on_realtime_transcription_stabilized = None
@@ -1,25 +1,46 @@
 import asyncio
 import logging
 import os
+import struct
+from concurrent.futures import Future
 from datetime import datetime
+from enum import IntEnum
 from threading import Thread
 from typing import Optional
 
-import numpy as np
-
-# DEBUGGING
-import soundfile as sf
 from RealtimeSTT import AudioToTextRecorder
 
+from batching import BatchedWhisper, BatchScheduler
+from ingest import AudioIngestor, OverflowPolicy, RotatingWavWriter
+from recorder import RecorderConfig, create_recorder, reset_recorder
+
 ADDR = "0.0.0.0"
 PORT = 9001
+HEALTH_PORT = 9011  # HTTP readiness probe
 
 CHUNK_LEN = 1.0
 SAMPLE_RATE = 16000
-DTYPE = "int16"
+SAMPLE_WIDTH = 2
+
+# Audio is queued for the recorder for at most this many seconds, see README.md
+INGEST_QUEUE_SECONDS = float(os.getenv("STT_INGEST_QUEUE_SECONDS", "5.0"))
+INGEST_POLICY = OverflowPolicy(os.getenv("STT_INGEST_POLICY", "drop_oldest"))
+
+# Message framing, see protocol.md
+HEADER = struct.Struct("<BI")  # message type, payload length
+RESULT = struct.Struct("<IQQ")  # utterance id, start sample, end sample
+
+
+class ResultType(IntEnum):
+    PARTIAL = 1
+    STABLE_PARTIAL = 2
+    FINAL = 3
+
 
 LOG_LEVEL = logging.INFO
 DEBUG_SAVE_WAV = False
+DEBUG_WAV_MAX_SECONDS = 600.0  # a new file is started after this duration...
+DEBUG_WAV_MAX_BYTES = 64 * 1024 * 1024  # ...or size
 
 if not os.path.exists("logs/"):
     os.makedirs("logs/")
@@ -36,108 +57,327 @@ logging.basicConfig(
 )
 
 
-def env_use_cuda() -> bool:
-    return os.getenv("USE_CUDA", "false").lower() in ("1", "true", "yes")
+class RecorderPool:
+    """
+    Recorders (each with its own Whisper model and VAD) loaded once at startup.
 
+    Each connection leases a recorder for its lifetime and returns it afterwards, so
+    reconnecting doesn't load any models.
+    """
+
+    size: int
+    idle: asyncio.Queue[AudioToTextRecorder]
+    ready: asyncio.Event  # set once all recorders are loaded
+
+    def __init__(self, size: int) -> None:
+        self.size = size
+        self.idle = asyncio.Queue()
+        self.ready = asyncio.Event()
+
+    async def load(self, config: RecorderConfig) -> None:
+        for i in range(self.size):
+            logger.info("Loading recorder %d/%d (%s)", i + 1, self.size, config)
+            stt = await asyncio.to_thread(create_recorder, config)
+            self.idle.put_nowait(stt)
+        self.ready.set()
+        logger.info("Recorder pool ready")
+
+    async def acquire(self) -> AudioToTextRecorder:
+        return await self.idle.get()
+
+    def release(self, stt: AudioToTextRecorder) -> None:
+        self.idle.put_nowait(stt)
+
+    def shutdown(self) -> None:
+        while not self.idle.empty():
+            self.idle.get_nowait().shutdown()
+
+
+class HealthProtocol(asyncio.Protocol):
+    """
+    Answers HTTP requests with 200 once the pool is ready, 503 before.
+
+    The response is only sent once the request's headers have been read, as closing
+    a connection with unread data resets it (and fails the probe).
+    """
+
+    MAX_REQUEST_BYTES = 8192
 
-class STTServerProtocol(asyncio.Protocol):
-    stt: AudioToTextRecorder
-    stt_thread: Thread
     transport: asyncio.Transport
+    request: bytearray
+
+    def __init__(self, pool: RecorderPool) -> None:
+        self.pool = pool
+        self.request = bytearray()
 
-    # DEBUGGING
-    audio_buffer: bytearray
-    connection_time: datetime
-
-    def __init__(self, model: str, device: str) -> None:
-        logger.info("Creating STT (model=%s, device=%s)", model, device)
-
-        self.stt = AudioToTextRecorder(
-            use_microphone=False,
-            model=model,
-            device=device,
-            spinner=False,
-            ensure_sentence_ends_with_period=True,
-            language="de",
-            print_transcription_time=True,
-            enable_realtime_transcription=True,
-            use_main_model_for_realtime=True,
-            silero_sensitivity=0.9,
-            silero_deactivity_detection=False,
-            no_log_file=True,
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        self.transport = transport  # type: ignore
+
+    def data_received(self, data: bytes) -> None:
+        self.request.extend(data)
+        if b"\r\n\r\n" in self.request or len(self.request) > self.MAX_REQUEST_BYTES:
+            self.respond()
+
+    def eof_received(self) -> bool | None:
+        self.respond()  # e.g. a bare request line
+        return None
+
+    def respond(self) -> None:
+        if self.transport.is_closing():
+            return
+        if self.pool.ready.is_set():
+            status, body = "200 OK", b"ready\n"
+        else:
+            status, body = "503 Service Unavailable", b"loading\n"
+        self.transport.write(
+            f"HTTP/1.0 {status}\r\n"
+            "Content-Type: text/plain\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n"
+            "\r\n".encode()
+            + body
         )
-        self.stt_thread = Thread(target=self.stt_loop, daemon=True)
+        self.transport.close()
+
 
-        if DEBUG_SAVE_WAV:
-            self.audio_buffer = bytearray()
+class STTServerProtocol(asyncio.Protocol):
+    pool: RecorderPool
+    scheduler: BatchScheduler | None  # batches final transcriptions of all sessions
+    stt: AudioToTextRecorder | None = None  # leased once a recorder is free
+    stt_thread: Thread
+    ingestor: AudioIngestor | None = None  # feeds the recorder off the event loop
+    transport: asyncio.Transport
+    loop: asyncio.AbstractEventLoop
+    session: asyncio.Task[None]
+    closed: asyncio.Event
+    active: bool = True
+    dropped_bytes: int = 0  # received before a recorder was leased
+
+    # Positions in the session's audio stream, in samples
+    recording_start: int = 0
+    utterance_id: int = 0  # of the current (or next) utterance
+
+    def __init__(
+        self, pool: RecorderPool, scheduler: BatchScheduler | None = None
+    ) -> None:
+        self.pool = pool
+        self.scheduler = scheduler
+        self.loop = asyncio.get_event_loop()
+        self.stt_thread = Thread(target=self.stt_loop, daemon=True)
+        self.closed = asyncio.Event()
 
     def connection_made(self, transport: asyncio.BaseTransport) -> None:
         peername = transport.get_extra_info("peername")
         logger.info("Connection from %s", peername)
 
         self.transport = transport  # type: ignore
-        self.stt_thread.start()
-
-        if DEBUG_SAVE_WAV:
-            self.connection_time = datetime.now()
+        self.session = self.loop.create_task(self.run_session())
+
+    async def run_session(self) -> None:
+        if self.pool.idle.empty():
+            logger.warning("Waiting for a free recorder")
+        stt = await self.pool.acquire()
+        try:
+            if not self.active:
+                return  # disconnected while waiting
+            if self.dropped_bytes:
+                logger.warning(
+                    "Dropped %d audio bytes while waiting for a recorder",
+                    self.dropped_bytes,
+                )
+
+            stt.on_recording_start = self.on_recording_start
+            stt.on_realtime_transcription_update = lambda text: self.on_partial(
+                text, ResultType.PARTIAL
+            )
+            stt.on_realtime_transcription_stabilized = lambda text: self.on_partial(
+                text, ResultType.STABLE_PARTIAL
+            )
+            self.ingestor = AudioIngestor(
+                stt.feed_audio,  # type: ignore
+                int(INGEST_QUEUE_SECONDS * SAMPLE_RATE),
+                INGEST_POLICY,
+                pause_reading=self.transport.pause_reading,
+                resume_reading=lambda: self.loop.call_soon_threadsafe(
+                    self.resume_reading
+                ),
+                wav_writer=RotatingWavWriter(
+                    "logs",
+                    "received_audio",
+                    SAMPLE_RATE,
+                    DEBUG_WAV_MAX_SECONDS,
+                    DEBUG_WAV_MAX_BYTES,
+                )
+                if DEBUG_SAVE_WAV
+                else None,
+            )
+            self.stt = stt
+            self.stt_thread.start()
+            await self.closed.wait()
+
+            # Feeds the remaining queued audio; the recorder is only reset after
+            await asyncio.to_thread(self.ingestor.close)
+            logger.info("Ingest stats: %s", self.ingestor.stats())
+
+            # Interrupts `text`, which waits for voice activity in the STT thread
+            stt.interrupt_stop_event.set()
+            await asyncio.to_thread(self.stt_thread.join)
+            await asyncio.to_thread(reset_recorder, stt)
+            logger.info("Recorder reset and returned to the pool")
+        finally:
+            self.stt = None
+            self.pool.release(stt)
 
     def connection_lost(self, exc: Optional[Exception]) -> None:
         logger.warning("Connection closed: %s", exc)
-        self.stt.shutdown()
-        self.stt_thread.join(1)
-        logger.info("Cleaned up")
-
-        if DEBUG_SAVE_WAV and hasattr(self, "audio_buffer") and self.audio_buffer:
-            filename = f"logs/received_audio_{self.connection_time.strftime('%Y-%m-%d_%H-%M-%S')}.wav"
-            logger.info(
-                "Writing %d bytes of audio to %s", len(self.audio_buffer), filename
-            )
-            try:
-                audio_array = np.frombuffer(self.audio_buffer, dtype=DTYPE)
-                sf.write(filename, audio_array, SAMPLE_RATE)
-                logger.info("Successfully saved debug audio to %s", filename)
-            except Exception as e:
-                logger.error("Could not save debug audio file: %s", e)
+        self.active = False
+        self.closed.set()
 
     def data_received(self, data: bytes) -> None:
         logger.debug("Received %d audio bytes", len(data))
-        self.stt.feed_audio(data)  # type: ignore
-        if DEBUG_SAVE_WAV:
-            self.audio_buffer.extend(data)
+        if self.ingestor is None:
+            self.dropped_bytes += len(data)
+            return
+
+        self.ingestor.put(data)
+
+    def resume_reading(self) -> None:
+        if self.active:
+            self.transport.resume_reading()
 
     def stt_loop(self) -> None:
         logger.info("Starting STT loop")
-        while self.stt.is_running:
-            self.stt.text(self.write_text)  # type: ignore
+        assert self.stt is not None
+        while self.active and self.stt.is_running:
+            self.record_utterance(self.stt)
         logger.info("Ending STT loop")
 
-    def write_text(self, text: str) -> None:
-        logger.debug("Sending %d text bytes", len(text))
-        logger.info("Sending transcription result: %s", text)
-        self.transport.write(text.encode())
+    def record_utterance(self, stt: AudioToTextRecorder) -> None:
+        # Like `text`, but keeps track of the utterance's position in the stream
+        stt.interrupt_stop_event.clear()
+        stt.wait_audio()
+        if stt.interrupt_stop_event.is_set() or stt.audio is None or not len(stt.audio):
+            return
+
+        utterance_id = self.utterance_id
+        self.utterance_id += 1
+        end = self.processed_samples()
+        start = max(0, end - len(stt.audio))
+
+        def send_final(text: str) -> None:
+            self.send_result(ResultType.FINAL, utterance_id, start, end, text)
+
+        if self.scheduler is None:
+            # Synchronously, like `text`: `transcribe` reads `stt.audio` and resets the
+            # recorder's state once it's done, so the next utterance must wait for it.
+            # Audio fed meanwhile is queued, so it isn't lost.
+            send_final(stt.transcribe())
+            return
+
+        audio = stt.audio.copy()
+        stt._set_state("inactive")  # ready for the next utterance
+
+        def on_transcribed(future: Future[str]) -> None:
+            try:
+                send_final(stt._preprocess_output(future.result()))
+            except Exception as e:
+                logger.error("Transcription failed: %s", e)
+
+        future = asyncio.run_coroutine_threadsafe(
+            self.scheduler.transcribe(audio), self.loop
+        )
+        future.add_done_callback(on_transcribed)
+
+    def processed_samples(self) -> int:
+        """Number of received samples the recorder has processed so far."""
+        assert self.stt is not None and self.ingestor is not None
+        backlog = len(self.stt.buffer) // SAMPLE_WIDTH
+        try:
+            # `feed_audio` queues chunks of `buffer_size` samples
+            backlog += self.stt.audio_queue.qsize() * self.stt.buffer_size
+        except NotImplementedError:  # qsize isn't available on macOS
+            pass
+        return max(0, self.ingestor.fed_samples - backlog)
+
+    def on_recording_start(self) -> None:
+        assert self.stt is not None
+        pre_roll = int(self.stt.pre_recording_buffer_duration * SAMPLE_RATE)
+        self.recording_start = max(0, self.processed_samples() - pre_roll)
+
+    def on_partial(self, text: str, result_type: ResultType) -> None:
+        end = self.processed_samples()
+        self.send_result(
+            result_type, self.utterance_id, self.recording_start, end, text
+        )
+
+    def send_result(
+        self,
+        result_type: ResultType,
+        utterance_id: int,
+        start: int,
+        end: int,
+        text: str,
+    ) -> None:
+        # Called from RealtimeSTT threads
+        payload = RESULT.pack(utterance_id, start, end) + text.encode()
+        self.loop.call_soon_threadsafe(self.write_message, result_type, payload, text)
+
+    def write_message(self, result_type: ResultType, payload: bytes, text: str) -> None:
+        if not self.active or not text:
+            return
+        if result_type == ResultType.FINAL:
+            logger.info("Sending transcription result: %s", text)
+        else:
+            logger.debug("Sending partial transcription result: %s", text)
+        self.transport.writelines([HEADER.pack(result_type, len(payload)), payload])
 
 
 async def main():
     loop = asyncio.get_event_loop()
 
-    use_cuda = env_use_cuda()
-    model = "large-v2" if use_cuda else "small"
-    device = "cuda" if use_cuda else "cpu"
+    config = RecorderConfig.from_env()
+    pool = RecorderPool(int(os.getenv("STT_POOL_SIZE", "1")))
+
+    # Batching only pays off if several sessions transcribe at the same time
+    scheduler = None
+    batch_size = int(os.getenv("STT_BATCH_SIZE", str(pool.size)))
+    if batch_size > 1:
+        logger.info("Loading batch transcription model (batch size %d)", batch_size)
+        batched_model = await asyncio.to_thread(
+            BatchedWhisper,
+            config.model,
+            config.device,
+            config.compute_type,
+            beam_size=config.beam_size,
+            cpu_threads=config.cpu_threads,
+        )
+        scheduler = BatchScheduler(
+            batched_model,
+            max_batch_size=batch_size,
+            max_wait=float(os.getenv("STT_BATCH_MAX_WAIT", "0.05")),
+        )
 
-    logger.info("Initializing STT (model=%s, device=%s)", model, device)
     logger.info("Opening server socket on (%s:%d)", ADDR, PORT)
-
     server = await loop.create_server(
-        lambda: STTServerProtocol(model, device),
+        lambda: STTServerProtocol(pool, scheduler),
         ADDR,
         PORT,
         reuse_address=True,
         reuse_port=True,
     )
+    health_server = await loop.create_server(
+        lambda: HealthProtocol(pool), ADDR, HEALTH_PORT, reuse_address=True
+    )
 
-    async with server:
-        logger.info("Serving")
-        await server.serve_forever()
+    try:
+        async with server, health_server, asyncio.TaskGroup() as tg:
+            if scheduler is not None:
+                tg.create_task(scheduler.run())
+            await pool.load(config)
+            logger.info("Serving")
+            await server.serve_forever()
+    finally:
+        pool.shutdown()
 
 
 if __name__ == "__main__":
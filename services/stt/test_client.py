@@ -1,4 +1,5 @@
 import asyncio
+import struct
 import sys
 
 import pyaudio
@@ -12,6 +13,11 @@ SAMPLE_WIDTH = 2  # 16-bit PCM
 CHUNK_MS = 50  # send ~50ms frames
 FRAMES_PER_CHUNK = SAMPLE_RATE * CHUNK_MS // 1000
 
+# Message framing, see protocol.md
+HEADER = struct.Struct("<BI")
+RESULT = struct.Struct("<IQQ")
+PARTIAL, STABLE_PARTIAL, FINAL = 1, 2, 3
+
 
 async def send_mic_audio(writer, stream):
     try:
@@ -31,11 +37,19 @@ async def send_mic_audio(writer, stream):
 async def print_server_text(reader):
     try:
         while True:
-            chunk = await reader.read(1024)
-            if not chunk:
-                break
-            sys.stdout.write(chunk.decode(errors="ignore"))
+            msg_type, length = HEADER.unpack(await reader.readexactly(HEADER.size))
+            payload = await reader.readexactly(length)
+            utterance_id, start, end = RESULT.unpack_from(payload)
+            text = payload[RESULT.size :].decode(errors="ignore")
+            if msg_type == FINAL:
+                sys.stdout.write(
+                    f"\r[{utterance_id}] {start / SAMPLE_RATE:.2f}-{end / SAMPLE_RATE:.2f}s: {text}\n"
+                )
+            else:
+                sys.stdout.write(f"\r[{utterance_id}] ... {text}")
             sys.stdout.flush()
+    except asyncio.IncompleteReadError:  # server closed
+        pass
     except asyncio.CancelledError:
         pass
 
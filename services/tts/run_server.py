@@ -1,6 +1,10 @@
 import asyncio
+import codecs
+import json
 import logging
 import os
+import struct
+from enum import IntEnum
 from time import sleep
 
 from RealtimeTTS import BaseEngine, TextToAudioStream
@@ -8,6 +12,32 @@ from RealtimeTTS import BaseEngine, TextToAudioStream
 ADDR = "0.0.0.0"
 PORT = 9002
 
+# Message framing, see protocol.md
+HEADER = struct.Struct("<BI")  # message type, payload length
+SEQ = struct.Struct("<I")
+
+
+class ClientMessage(IntEnum):
+    TEXT = 1
+    CANCEL = 2
+    PHRASE = 3
+    MARK = 4
+    PREFETCH = 5
+
+
+class ServerMessage(IntEnum):
+    AUDIO = 1
+    CANCEL_ACK = 2
+    INFO = 3
+    PHRASE_START = 4
+    PHRASE_END = 5
+    MARK = 6
+    PHRASE_ABORTED = 7
+
+
+AZURE_VOICE = "de-DE-FlorianMultilingualNeural"
+COQUI_VOICE = "default"
+
 logging.basicConfig(level=logging.INFO, force=True)
 logger = logging.getLogger(__name__)
 
@@ -26,7 +56,7 @@ def get_engine(backend: str) -> BaseEngine:
         return AzureEngine(
             speech_key=key,
             service_region=region,
-            voice="de-DE-FlorianMultilingualNeural",
+            voice=AZURE_VOICE,
             audio_format="riff-24khz-16bit-mono-pcm",
         )
     else:
@@ -37,9 +67,24 @@ class TTSProtocol(asyncio.Protocol):
     transport: asyncio.Transport
     engine: BaseEngine
     tts: TextToAudioStream
+    info: dict[str, str | int]  # identifies the voice, e.g. for client-side caching
 
-    def __init__(self, engine: BaseEngine) -> None:
+    loop: asyncio.AbstractEventLoop
+    buf: bytearray
+    text_decoder: codecs.IncrementalDecoder  # characters may span TEXT messages
+    messages: asyncio.Queue[tuple[int, bytes]]
+    message_task: asyncio.Task[None]
+    current: tuple[int, asyncio.Task[None]] | None = None  # message being handled
+
+    def __init__(self, engine: BaseEngine, backend: str, voice: str) -> None:
         self.engine = engine
+        _, _, sample_rate = engine.get_stream_info()
+        self.info = {"backend": backend, "voice": voice, "sample_rate": sample_rate}
+        self.loop = asyncio.get_event_loop()
+        self.buf = bytearray()
+        self.text_decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.messages = asyncio.Queue()
+
         logger.info("Starting TTS Stream")
         self.tts = TextToAudioStream(
             engine=self.engine,
@@ -51,27 +96,154 @@ class TTSProtocol(asyncio.Protocol):
     def connection_made(self, transport: asyncio.BaseTransport) -> None:
         self.transport = transport  # type: ignore
         logger.info("Connection made; starting playback")
+        self._write_message(ServerMessage.INFO, json.dumps(self.info).encode())
+        self.message_task = self.loop.create_task(self._process_messages())
         self._play()
         sleep(1)
 
     def data_received(self, data: bytes) -> None:
-        self.tts.feed(data.decode())
-        if not self.tts.is_playing():
-            self._play()
+        self.buf.extend(data)
+
+        while len(self.buf) >= HEADER.size:
+            msg_type, length = HEADER.unpack_from(self.buf)
+            end = HEADER.size + length
+            if len(self.buf) < end:
+                break
+
+            payload = bytes(self.buf[HEADER.size : end])
+            del self.buf[:end]
+
+            if msg_type == ClientMessage.CANCEL:
+                # Everything sent before the cancel is discarded anyway, so the cancel
+                # overtakes it instead of waiting for e.g. a phrase to be synthesized
+                while not self.messages.empty():
+                    self.messages.get_nowait()
+                self._interrupt()
+            elif self.current is not None and self.current[0] == ClientMessage.PREFETCH:
+                self._interrupt()  # prefetching mustn't delay anything
+            self.messages.put_nowait((msg_type, payload))
 
     def connection_lost(self, exc: Exception | None) -> None:
         logger.info(f"Connection lost: {exc}")
+        self.message_task.cancel()
+        if self.current is not None:
+            self.current[1].cancel()
         self.tts.stop()
 
+    async def _process_messages(self) -> None:
+        # Messages are handled in order, e.g. text sent after a cancel must only be
+        # fed once the cancel is complete. Each one is handled in its own task, so
+        # it can be interrupted (see `_interrupt`).
+        while True:
+            msg_type, payload = await self.messages.get()
+            task = self.loop.create_task(self._handle_message(msg_type, payload))
+            self.current = (msg_type, task)
+            try:
+                await asyncio.wait([task])
+            finally:
+                self.current = None
+
+    def _interrupt(self) -> None:
+        """Interrupt the message being handled, unless it's a cancel."""
+        if self.current is None:
+            return
+        msg_type, task = self.current
+        if msg_type != ClientMessage.CANCEL and not task.cancelling():
+            task.cancel()
+
+    async def _handle_message(self, msg_type: int, payload: bytes) -> None:
+        match msg_type:
+            case ClientMessage.TEXT:
+                text = self.text_decoder.decode(payload)
+                if not text:
+                    return  # only part of a character
+                self.tts.feed(text)
+                if not self.tts.is_playing():
+                    self._play()
+
+            case ClientMessage.CANCEL:
+                (seq,) = SEQ.unpack(payload)
+                logger.info("Cancelling synthesis (seq=%d)", seq)
+                # Stops synthesis, clears the fed text and joins the play thread
+                await self.loop.run_in_executor(None, self.tts.stop)
+                self.text_decoder.reset()
+                # Audio chunks of the stopped synthesis were scheduled before this
+                self.loop.call_soon(
+                    self._write_message, ServerMessage.CANCEL_ACK, SEQ.pack(seq)
+                )
+
+            case ClientMessage.PHRASE:
+                await self._wait_synthesized()
+                await self._synthesize_phrase(payload)
+
+            case ClientMessage.PREFETCH:
+                (phrase_id,) = SEQ.unpack_from(payload)
+                started = False
+                try:
+                    await self._wait_synthesized()
+                    if self.messages.empty():  # else it would delay them
+                        started = True
+                        await self._synthesize_phrase(payload)
+                        return
+                except asyncio.CancelledError:
+                    # Interrupted by a later message, only stop the phrase itself
+                    if started:
+                        await self.loop.run_in_executor(None, self.tts.stop)
+                logger.info("Aborted prefetching phrase %d", phrase_id)
+                self.loop.call_soon(
+                    self._write_message,
+                    ServerMessage.PHRASE_ABORTED,
+                    SEQ.pack(phrase_id),
+                )
+
+            case ClientMessage.MARK:
+                await self._wait_synthesized()
+                self.loop.call_soon(
+                    self._write_message, ServerMessage.MARK, payload[: SEQ.size]
+                )
+
+            case _:
+                logger.warning("Ignoring unknown message type %d", msg_type)
+
+    async def _synthesize_phrase(self, payload: bytes) -> None:
+        (phrase_id,) = SEQ.unpack_from(payload)
+        text = payload[SEQ.size :].decode(errors="replace")
+        # All previous text must be synthesized, so the phrase's audio can be delimited
+        self.loop.call_soon(
+            self._write_message, ServerMessage.PHRASE_START, SEQ.pack(phrase_id)
+        )
+        self.tts.feed(text)
+        self._play()
+        await self._wait_synthesized()
+        self.loop.call_soon(
+            self._write_message, ServerMessage.PHRASE_END, SEQ.pack(phrase_id)
+        )
+
+    async def _wait_synthesized(self) -> None:
+        # The play thread finishes once all fed text has been synthesized
+        play_thread = self.tts.play_thread
+        if play_thread is not None and play_thread.is_alive():
+            await self.loop.run_in_executor(None, play_thread.join)
+
+    def _write_message(self, msg_type: ServerMessage, payload: bytes) -> None:
+        if self.transport.is_closing():
+            return
+        self.transport.writelines([HEADER.pack(msg_type, len(payload)), payload])
+
+    def _on_audio_chunk(self, chunk: bytes) -> None:
+        # Called from the synthesis thread
+        self.loop.call_soon_threadsafe(self._write_message, ServerMessage.AUDIO, chunk)
+
     def _play(self) -> None:
         self.tts.play_async(
-            language="de", muted=True, on_audio_chunk=self.transport.write
+            language="de", muted=True, on_audio_chunk=self._on_audio_chunk
         )
 
 
 async def main():
     use_cuda = os.getenv("USE_CUDA", "false").lower() in ("1", "true", "yes")
     backend = "coqui" if use_cuda else "azure"
+    voice = COQUI_VOICE if use_cuda else AZURE_VOICE
 
     logger.info(f"Initializing engine (backend={backend})")
     engine = get_engine(backend)
@@ -79,7 +251,7 @@ async def main():
 
     loop = asyncio.get_event_loop()
     server = await loop.create_server(
-        lambda: TTSProtocol(engine),
+        lambda: TTSProtocol(engine, backend, voice),
         ADDR,
         PORT,
         reuse_address=True,
@@ -1,4 +1,5 @@
 import asyncio
+import struct
 import sys
 
 import pyaudio
@@ -10,20 +11,30 @@ SAMPLE_RATE = 24000
 CHANNELS = 1
 SAMPLE_WIDTH = 2  # 16-bit PCM
 
+# Message framing, see protocol.md
+HEADER = struct.Struct("<BI")
+TEXT, CANCEL = 1, 2
+AUDIO, CANCEL_ACK = 1, 2
+
 
 async def play_audio(reader, stream):
     try:
         while True:
-            chunk = await reader.read(4096)
-            if not chunk:  # server closed
-                break
-            await asyncio.to_thread(stream.write, chunk)
+            msg_type, length = HEADER.unpack(await reader.readexactly(HEADER.size))
+            payload = await reader.readexactly(length)
+            if msg_type == AUDIO:
+                await asyncio.to_thread(stream.write, payload)
+            elif msg_type == CANCEL_ACK:
+                print("Cancelled:", struct.unpack("<I", payload)[0])
+    except asyncio.IncompleteReadError:  # server closed
+        pass
     except Exception as e:
         print("Playback error:", e)
 
 
 async def send_input(writer):
     loop = asyncio.get_running_loop()
+    seq = 0
     try:
         while True:
             line = await loop.run_in_executor(None, sys.stdin.readline)
@@ -34,7 +45,12 @@ async def send_input(writer):
                 continue
             if line.lower() in ("exit", "quit"):
                 break
-            writer.write(line.encode())
+            if line.lower() == "cancel":
+                seq += 1
+                writer.write(HEADER.pack(CANCEL, 4) + struct.pack("<I", seq))
+            else:
+                data = line.encode()
+                writer.write(HEADER.pack(TEXT, len(data)) + data)
             await writer.drain()
     except KeyboardInterrupt:
         pass
@@ -51,7 +67,7 @@ async def main():
         output=True,
     )
 
-    print("Enter text to speak (Ctrl-D or 'exit' to quit):")
+    print("Enter text to speak ('cancel' to stop, Ctrl-D or 'exit' to quit):")
 
     play_task = asyncio.create_task(play_audio(reader, stream))
     try: